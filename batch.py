@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# runs many test cases (<name>.src with optional .in, .out and .rc next to it) with
+# interpret.py, every case runs in a child forked from this process so imports are
+# done once and interpreter globals start clean, results go out as JSON lines
+import argparse
+import gc
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+import traceback
+
+import interpret
+
+
+def case_from_source(source):
+    base = source[:-len(".src")]
+    return {
+        "name": os.path.basename(base),
+        "source": source,
+        "input": base + ".in" if os.path.exists(base + ".in") else None,
+        "output": base + ".out" if os.path.exists(base + ".out") else None,
+        "rc": base + ".rc" if os.path.exists(base + ".rc") else None,
+    }
+
+
+# directories are searched recursively for .src files, a manifest has one JSON object
+# per line with source and optionally input, output (expected stdout) and rc
+def find_cases(paths, manifest):
+    cases = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, files in sorted(os.walk(path)):
+                for file in sorted(files):
+                    if file.endswith(".src"):
+                        cases.append(case_from_source(os.path.join(directory, file)))
+        else:
+            cases.append(case_from_source(path))
+    if manifest:
+        with open(manifest) as manifest_file:
+            for line in manifest_file:
+                if line.strip():
+                    entry = json.loads(line)
+                    entry.setdefault("name", os.path.basename(entry["source"]))
+                    cases.append(entry)
+    return cases
+
+
+def expected_result(case):
+    expected_code = None
+    if case.get("rc") is not None:
+        if isinstance(case["rc"], int):
+            expected_code = case["rc"]
+        else:
+            with open(case["rc"]) as rc_file:
+                expected_code = int(rc_file.read().strip() or 0)
+    expected_output = None
+    if case.get("output") is not None:
+        with open(case["output"], "rb") as output_file:
+            expected_output = output_file.read()
+        if expected_code is None:
+            expected_code = 0
+    return expected_code, expected_output
+
+
+# child side, never returns
+def run_case(case, options, output_path, error_path):
+    code = 99
+    try:
+        with open(output_path, "w") as output, open(error_path, "w") as errors:
+            sys.stdout = interpret.standard_output.stream = output
+            sys.stderr = interpret.error_output.stream = errors
+            sys.argv = ["interpret.py", "--source", case["source"],
+                        "--input", case.get("input") or os.devnull] + options
+            try:
+                interpret.main()
+                code = 0
+            except SystemExit as request:
+                if request.code is None:
+                    code = 0
+                else:
+                    code = request.code if isinstance(request.code, int) else 1
+            except BaseException:
+                traceback.print_exc(file=errors)
+            interpret.flush_outputs()
+    finally:
+        os._exit(code)
+
+
+def start_case(case, options, workspace, number):
+    output_path = os.path.join(workspace, "%d.out" % number)
+    error_path = os.path.join(workspace, "%d.err" % number)
+    pid = os.fork()
+    if pid == 0:
+        run_case(case, options, output_path, error_path)
+    return pid, output_path, error_path
+
+
+def collect_output(path):
+    try:
+        with open(path, "rb") as captured:
+            return captured.read()
+    finally:
+        os.unlink(path)
+
+
+def case_result(case, exit_code, elapsed, output, errors, keep_output):
+    result = {"name": case["name"], "source": case["source"], "exit_code": exit_code,
+              "time_s": round(elapsed, 6)}
+    if exit_code is None:
+        result["status"] = "timeout"
+    else:
+        result["status"] = "done"
+        if keep_output:
+            result["stdout"] = output.decode(errors="replace")
+        if errors:
+            result["stderr"] = errors.decode(errors="replace")
+    expected_code, expected_output = expected_result(case)
+    if expected_code is not None:
+        # output is checked only for runs that are expected to succeed
+        passed = exit_code == expected_code
+        if passed and expected_code == 0 and expected_output is not None:
+            passed = output == expected_output
+        result["expected_exit_code"] = expected_code
+        result["passed"] = passed
+    return result
+
+
+def run_batch(cases, options, jobs, timeout, keep_output, results):
+    # state built during the imports stays shared with the children
+    gc.freeze()
+    summary = {"cases": len(cases), "passed": 0, "failed": 0, "timeouts": 0}
+    pending = list(reversed(cases))
+    running = {}
+    with tempfile.TemporaryDirectory(prefix="ipp_batch") as workspace:
+        number = 0
+        while pending or running:
+            while pending and len(running) < jobs:
+                case = pending.pop()
+                number += 1
+                pid, output_path, error_path = start_case(case, options, workspace, number)
+                running[pid] = (case, time.perf_counter(), output_path, error_path)
+
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            finished = []
+            if pid:
+                finished.append((pid, os.waitstatus_to_exitcode(status)))
+            else:
+                now = time.perf_counter()
+                for child, (case, started, _, _) in running.items():
+                    if now - started > timeout:
+                        os.kill(child, signal.SIGKILL)
+                        os.waitpid(child, 0)
+                        finished.append((child, None))
+                if not finished:
+                    time.sleep(0.0005)
+
+            for child, exit_code in finished:
+                case, started, output_path, error_path = running.pop(child)
+                elapsed = time.perf_counter() - started
+                result = case_result(case, exit_code, elapsed, collect_output(output_path),
+                                     collect_output(error_path), keep_output)
+                if exit_code is None:
+                    summary["timeouts"] += 1
+                if "passed" in result:
+                    summary["passed" if result["passed"] else "failed"] += 1
+                results.write(json.dumps(result) + "\n")
+                results.flush()
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run many interpret.py test cases in parallel')
+    parser.add_argument('paths', nargs='*', help='.src files or directories searched for them')
+    parser.add_argument('--manifest', metavar='FILE', help='JSON lines with source, input, output and rc')
+    parser.add_argument('--jobs', type=int, default=len(os.sched_getaffinity(0)),
+                        help='Cases run at once, defaults to the available cores')
+    parser.add_argument('--timeout', type=float, default=10, help='Seconds before a case is killed')
+    parser.add_argument('--options', default='', help='Extra interpret.py options, e.g. --options="--optimize=1"')
+    parser.add_argument('--no-stdout', action='store_true', help='Leave program output out of the results')
+    parser.add_argument('--results', metavar='FILE', help='Write JSON lines to FILE instead of stdout')
+    arguments = parser.parse_args()
+
+    cases = find_cases(arguments.paths, arguments.manifest)
+    if not cases:
+        parser.error("no test cases given")
+    results = open(arguments.results, "w") if arguments.results else sys.stdout
+    summary = run_batch(cases, arguments.options.split(), max(arguments.jobs, 1), arguments.timeout,
+                        not arguments.no_stdout, results)
+    print("%(cases)d cases, %(passed)d passed, %(failed)d failed, %(timeouts)d timed out" % summary,
+          file=sys.stderr)
+    sys.exit(1 if summary["failed"] else 0)
+
+
+if __name__ == '__main__':
+    main()
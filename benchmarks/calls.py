@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# calls per second for frames of different sizes, frame size is the number of local
+# variable names in the program (slots every frame has), calls define only one or two
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import interpret
+import generate
+
+
+def unused_locals(size):
+    # never called, only makes every frame bigger
+    return ["LABEL unused"] + ["DEFVAR LF@u%d" % index for index in range(size)]
+
+
+# CREATEFRAME, PUSHFRAME, CALL, POPFRAME and RETURN for every iteration
+def loop_program(size, count):
+    lines = [
+        "DEFVAR GF@i",
+        "MOVE GF@i int@0",
+        "LABEL loop",
+        "CREATEFRAME",
+        "DEFVAR TF@n",
+        "MOVE TF@n GF@i",
+        "PUSHFRAME",
+        "CALL f",
+        "ADD GF@i GF@i int@1",
+        "JUMPIFNEQ loop GF@i int@%d" % count,
+        "EXIT int@0",
+        "LABEL f",
+        "DEFVAR LF@r",
+        "MOVE LF@r LF@n",
+        "POPFRAME",
+        "RETURN",
+    ]
+    return lines + unused_locals(size)
+
+
+# chains of nested calls, frames of the whole chain are alive at once
+def recursive_program(size, count, depth=100):
+    lines = [
+        "DEFVAR GF@i",
+        "MOVE GF@i int@0",
+        "LABEL loop",
+        "CREATEFRAME",
+        "DEFVAR TF@n",
+        "MOVE TF@n int@%d" % depth,
+        "CALL f",
+        "ADD GF@i GF@i int@1",
+        "JUMPIFNEQ loop GF@i int@%d" % (count // depth),
+        "EXIT int@0",
+        "LABEL f",
+        "PUSHFRAME",
+        "JUMPIFEQ back LF@n int@1",
+        "CREATEFRAME",
+        "DEFVAR TF@n",
+        "SUB TF@n LF@n int@1",
+        "CALL f",
+        "LABEL back",
+        "POPFRAME",
+        "RETURN",
+    ]
+    return lines + unused_locals(size)
+
+
+def calls_per_second(lines, calls, repeat):
+    program = interpret.Program(generate.assemble(lines))
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        code, _ = program.run()
+        elapsed = time.perf_counter() - started
+        if code != 0:
+            raise RuntimeError("benchmark program ended with exit code %d" % code)
+        best = elapsed if best is None else min(best, elapsed)
+    return calls / best, len(program.local_template)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calls per second at different frame sizes')
+    parser.add_argument('--sizes', type=int, nargs='*', default=[1, 16, 128, 1024],
+                        help='Unused local variables added to the program')
+    parser.add_argument('--calls', type=int, default=100000, help='Calls per measurement')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement, best is reported')
+    arguments = parser.parse_args()
+
+    print("%10s %14s %14s" % ("frame size", "loop calls/s", "nested calls/s"))
+    for size in arguments.sizes:
+        loop, slots = calls_per_second(loop_program(size, arguments.calls), arguments.calls, arguments.repeat)
+        nested, _ = calls_per_second(recursive_program(size, arguments.calls), arguments.calls, arguments.repeat)
+        print("%10d %14.0f %14.0f" % (slots, loop, nested))
+
+
+if __name__ == '__main__':
+    main()
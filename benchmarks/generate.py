@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# generates IPPcode23 workloads as <name>.src/.in/.out, <name>.load.src only loads the
+# same program and exits right away so the runner can tell loading from execution
+import argparse
+import os
+from xml.sax.saxutils import escape
+
+
+def assemble(lines, first_order=1):
+    output = ['<?xml version="1.0" encoding="UTF-8"?>', '<program language="IPPcode23">']
+    order = first_order
+    for line in lines:
+        parts = line.split()
+        output.append('  <instruction order="%d" opcode="%s">' % (order, parts[0]))
+        for position, operand in enumerate(parts[1:], start=1):
+            prefix, _, value = operand.partition("@")
+            if prefix in ("GF", "LF", "TF"):
+                val_type, value = "var", operand
+            elif value or operand.endswith("@"):
+                val_type = prefix
+            elif operand in ("int", "float", "string", "bool"):
+                val_type, value = "type", operand
+            else:
+                val_type, value = "label", operand
+            output.append('    <arg%d type="%s">%s</arg%d>' % (position, val_type, escape(value), position))
+        output.append('  </instruction>')
+        order += 1
+    output.append('</program>')
+    return "\n".join(output) + "\n"
+
+
+def arithmetic(scale):
+    count = 100000 * scale
+    lines = [
+        "DEFVAR GF@i", "DEFVAR GF@sum", "DEFVAR GF@t",
+        "MOVE GF@i int@0", "MOVE GF@sum int@0",
+        "LABEL loop",
+        "MUL GF@t GF@i int@3",
+        "IDIV GF@t GF@t int@2",
+        "SUB GF@t GF@t int@1",
+        "ADD GF@sum GF@sum GF@t",
+        "ADD GF@i GF@i int@1",
+        "JUMPIFNEQ loop GF@i int@%d" % count,
+        "WRITE GF@sum",
+    ]
+    return lines, "", str(sum(index * 3 // 2 - 1 for index in range(count)))
+
+
+def recursion(scale):
+    depth = 19 + scale
+    lines = [
+        "DEFVAR GF@result",
+        "PUSHS int@%d" % depth,
+        "CALL fib",
+        "POPS GF@result",
+        "WRITE GF@result",
+        "JUMP end",
+        "LABEL fib",
+        "CREATEFRAME",
+        "PUSHFRAME",
+        "DEFVAR LF@n", "DEFVAR LF@a", "DEFVAR LF@c",
+        "POPS LF@n",
+        "LT LF@c LF@n int@2",
+        "JUMPIFEQ base LF@c bool@true",
+        "SUB LF@n LF@n int@1",
+        "PUSHS LF@n",
+        "CALL fib",
+        "POPS LF@a",
+        "SUB LF@n LF@n int@1",
+        "PUSHS LF@n",
+        "CALL fib",
+        "POPS LF@c",
+        "ADD LF@a LF@a LF@c",
+        "PUSHS LF@a",
+        "POPFRAME",
+        "RETURN",
+        "LABEL base",
+        "PUSHS LF@n",
+        "POPFRAME",
+        "RETURN",
+        "LABEL end",
+    ]
+    first, second = 0, 1
+    for _ in range(depth):
+        first, second = second, first + second
+    return lines, "", str(first)
+
+
+def strings(scale):
+    count = 20000 * scale
+    lines = [
+        "DEFVAR GF@s", "DEFVAR GF@i", "DEFVAR GF@k", "DEFVAR GF@c",
+        "MOVE GF@s string@", "MOVE GF@i int@0",
+        "LABEL build",
+        "IDIV GF@k GF@i int@26",
+        "MUL GF@k GF@k int@26",
+        "SUB GF@k GF@i GF@k",
+        "ADD GF@k GF@k int@97",
+        "INT2CHAR GF@c GF@k",
+        "CONCAT GF@s GF@s GF@c",
+        "ADD GF@i GF@i int@1",
+        "JUMPIFNEQ build GF@i int@%d" % count,
+        "MOVE GF@i int@0",
+        "LABEL upper",
+        "GETCHAR GF@c GF@s GF@i",
+        "STRI2INT GF@k GF@c int@0",
+        "SUB GF@k GF@k int@32",
+        "INT2CHAR GF@c GF@k",
+        "SETCHAR GF@s GF@i GF@c",
+        "ADD GF@i GF@i int@1",
+        "JUMPIFNEQ upper GF@i int@%d" % count,
+        "STRLEN GF@k GF@s",
+        "WRITE GF@k",
+        "WRITE GF@s",
+    ]
+    text = "".join(chr(65 + index % 26) for index in range(count))
+    return lines, "", str(count) + text
+
+
+def stack(scale):
+    count = 50000 * scale
+    lines = [
+        "DEFVAR GF@i", "DEFVAR GF@v", "DEFVAR GF@sum",
+        "MOVE GF@i int@0", "MOVE GF@sum int@0",
+        "LABEL push",
+        "PUSHS GF@i",
+        "ADD GF@i GF@i int@1",
+        "JUMPIFNEQ push GF@i int@%d" % count,
+        "LABEL pop",
+        "POPS GF@v",
+        "ADD GF@sum GF@sum GF@v",
+        "SUB GF@i GF@i int@1",
+        "JUMPIFNEQ pop GF@i int@0",
+        "WRITE GF@sum",
+    ]
+    return lines, "", str(count * (count - 1) // 2)
+
+
+# same computation as arithmetic written for the STACK extension
+def stack_arithmetic(scale):
+    count = 100000 * scale
+    lines = [
+        "DEFVAR GF@i", "DEFVAR GF@sum",
+        "MOVE GF@i int@0", "MOVE GF@sum int@0",
+        "LABEL loop",
+        "PUSHS GF@sum",
+        "PUSHS GF@i", "PUSHS int@3", "MULS",
+        "PUSHS int@2", "IDIVS",
+        "PUSHS int@1", "SUBS",
+        "ADDS",
+        "POPS GF@sum",
+        "PUSHS GF@i", "PUSHS int@1", "ADDS",
+        "POPS GF@i",
+        "PUSHS GF@i", "PUSHS int@%d" % count,
+        "JUMPIFNEQS loop",
+        "WRITE GF@sum",
+    ]
+    return lines, "", str(sum(index * 3 // 2 - 1 for index in range(count)))
+
+
+# FLOAT extension, literals in both hex and decimal
+def floats(scale):
+    count = 100000 * scale
+    lines = [
+        "DEFVAR GF@i", "DEFVAR GF@x", "DEFVAR GF@v",
+        "MOVE GF@i int@0", "MOVE GF@x float@0x0p+0",
+        "LABEL loop",
+        "INT2FLOAT GF@v GF@i",
+        "MUL GF@v GF@v float@0x1.8p+0",
+        "DIV GF@v GF@v float@2.5",
+        "SUB GF@v GF@v float@1",
+        "ADD GF@x GF@x GF@v",
+        "ADD GF@i GF@i int@1",
+        "JUMPIFNEQ loop GF@i int@%d" % count,
+        "WRITE GF@x",
+    ]
+    total = 0.0
+    for index in range(count):
+        total += float(index) * 1.5 / 2.5 - 1.0
+    return lines, "", total.hex()
+
+
+def reading(scale):
+    count = 50000 * scale
+    lines = [
+        "DEFVAR GF@v", "DEFVAR GF@t", "DEFVAR GF@sum",
+        "MOVE GF@sum int@0",
+        "LABEL loop",
+        "READ GF@v int",
+        "TYPE GF@t GF@v",
+        "JUMPIFEQ done GF@t string@nil",
+        "ADD GF@sum GF@sum GF@v",
+        "JUMP loop",
+        "LABEL done",
+        "WRITE GF@sum",
+    ]
+    input_text = "".join("%d\n" % index for index in range(count))
+    return lines, input_text, str(count * (count - 1) // 2)
+
+
+workloads = {
+    "arithmetic": arithmetic,
+    "recursion": recursion,
+    "strings": strings,
+    "stack": stack,
+    "stackcode": stack_arithmetic,
+    "floats": floats,
+    "reading": reading,
+}
+
+
+def generate(directory, scale=1, names=None):
+    os.makedirs(directory, exist_ok=True)
+    for name in names or workloads:
+        lines, input_text, expected = workloads[name](scale)
+        base = os.path.join(directory, name)
+        with open(base + ".src", "w") as source:
+            source.write(assemble(lines))
+        with open(base + ".load.src", "w") as source:
+            source.write(assemble(["EXIT int@0"] + lines))
+        with open(base + ".in", "w") as input_file:
+            input_file.write(input_text)
+        with open(base + ".out", "w") as output_file:
+            output_file.write(expected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate IPPcode23 benchmark workloads')
+    parser.add_argument('--dir', default='bench_programs', help='Output directory')
+    parser.add_argument('--scale', type=int, default=1, help='Workload size multiplier')
+    parser.add_argument('--only', nargs='*', choices=sorted(workloads), help='Generate only these workloads')
+    arguments = parser.parse_args()
+    generate(arguments.dir, arguments.scale, arguments.only)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# bytes kept per defined variable and per data stack entry by each engine, and per
+# instruction by each program format
+import argparse
+import io
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import interpret
+
+
+def program_xml(kind, count):
+    lines = ['<program language="IPPcode23">']
+    body = []
+    if kind == "variables":
+        for index in range(count):
+            body.append(("DEFVAR", [("var", "GF@v%d" % index)]))
+            body.append(("MOVE", [("var", "GF@v%d" % index), ("int", str(100000 + index))]))
+    else:
+        body.append(("DEFVAR", [("var", "GF@x")]))
+        body.append(("MOVE", [("var", "GF@x"), ("int", "100000")]))
+        for index in range(count):
+            body.append(("PUSHS", [("var", "GF@x")]))
+    for order, (opcode, arguments) in enumerate(body, start=1):
+        lines.append('<instruction order="%d" opcode="%s">' % (order, opcode))
+        for position, (val_type, value) in enumerate(arguments, start=1):
+            lines.append('<arg%d type="%s">%s</arg%d>' % (position, val_type, value, position))
+        lines.append('</instruction>')
+    lines.append('</program>')
+    return "\n".join(lines).encode()
+
+
+# objects owned by the loaded program (literals, names in arguments) are not counted
+def footprint(root, shared):
+    seen = set(shared)
+    total = 0
+    pending = [root]
+    while pending:
+        item = pending.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            pending.extend(item.keys())
+            pending.extend(item.values())
+        elif isinstance(item, list):
+            pending.extend(item)
+        elif isinstance(item, interpret.Variable):
+            pending.extend((item.name, item.value, item.var_type))
+    return total
+
+
+def measure(engine, kind, count):
+    instruction_list = interpret.load_xml_to_list(io.BytesIO(program_xml(kind, count)))
+    interpret.build_literal_table(instruction_list)
+    interpret.check_labels(instruction_list)
+    shared = {id(None), id(True), id(False), id(interpret.nil), id(interpret.uninitialized)}
+    for instruction in instruction_list:
+        for argument in instruction.arg_list:
+            shared.update((id(argument.val_type), id(argument.value), id(argument.literal)))
+    if engine == "classic":
+        interpret.interpret_code(instruction_list, None)
+    else:
+        interpret.interpret_threaded(interpret.decode_program(instruction_list))
+    if kind == "variables":
+        return footprint(interpret.global_frame, shared) / count
+    return footprint(interpret.data_stack, shared) / count
+
+
+def program_size(compact, count):
+    program = interpret.load_stream(io.BytesIO(program_xml("variables", count)), compact)
+    return interpret.program_bytes(program) / len(program)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory used by variables and data stack entries')
+    parser.add_argument('--count', type=int, default=20000, help='Variables or stack entries to create')
+    parser.add_argument('--measure', nargs=2, metavar=('ENGINE', 'KIND'), help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.measure:
+        print(measure(arguments.measure[0], arguments.measure[1], arguments.count))
+        return
+
+    print("%-10s %14s %14s" % ("engine", "B/variable", "B/stack entry"))
+    for engine in ("classic", "threaded"):
+        results = []
+        for kind in ("variables", "stack"):
+            # every measurement in its own process, engines keep their state in globals
+            completed = subprocess.run([sys.executable, __file__, "--count", str(arguments.count),
+                                        "--measure", engine, kind],
+                                       capture_output=True, text=True, check=True)
+            results.append(float(completed.stdout))
+        print("%-10s %14.1f %14.1f" % (engine, results[0], results[1]))
+
+    print()
+    print("%-10s %14s" % ("format", "B/instruction"))
+    for name, compact in (("objects", False), ("compact", True)):
+        print("%-10s %14.1f" % (name, program_size(compact, arguments.count)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# runs the generated workloads with every interpreter configuration and reports load
+# time, executed instructions per second and peak RSS, results also as JSON lines
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import generate
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+default_interpreters = {
+    "threaded": [sys.executable, os.path.join(root, "interpret.py"), "--engine=threaded"],
+    "classic": [sys.executable, os.path.join(root, "interpret.py"), "--engine=classic"],
+    "legacy": [sys.executable, os.path.join(root, "interpret.1py")],
+}
+
+
+# wall time, peak RSS of the child alone and its exit code, output goes to a file
+def timed_run(command, input_file, timeout):
+    with open(input_file, "rb") as stdin, tempfile.TemporaryFile() as stdout:
+        started = time.perf_counter()
+        process = subprocess.Popen(command, stdin=stdin, stdout=stdout, stderr=subprocess.DEVNULL)
+        while True:
+            pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                break
+            if time.perf_counter() - started > timeout:
+                process.kill()
+                os.wait4(process.pid, 0)
+                return None
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - started
+        process.returncode = os.waitstatus_to_exitcode(status)
+        stdout.seek(0)
+        return elapsed, usage.ru_maxrss, process.returncode, stdout.read()
+
+
+def executed_instructions(base):
+    with tempfile.NamedTemporaryFile(suffix=".json") as stats:
+        command = default_interpreters["threaded"] + ["--source", base + ".src", "--input", base + ".in",
+                                                      "--stats", stats.name, "--stats-format", "json"]
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            return json.load(stats)["executed"]
+        except (ValueError, KeyError):
+            return None
+
+
+def measure(name, interpreter, command, base, executed, repeat, timeout):
+    result = {"workload": name, "interpreter": interpreter}
+    best_load = best_total = None
+    peak = 0
+    status = "ok"
+    for _ in range(repeat):
+        loaded = timed_run(command + ["--source", base + ".load.src", "--input", base + ".in"],
+                           base + ".in", timeout)
+        finished = timed_run(command + ["--source", base + ".src", "--input", base + ".in"],
+                             base + ".in", timeout)
+        if loaded is None or finished is None:
+            status = "timeout"
+            break
+        with open(base + ".out", "rb") as expected:
+            if finished[2] != 0:
+                status = "exit %d" % finished[2]
+            elif finished[3] != expected.read():
+                status = "wrong output"
+        best_load = loaded[0] if best_load is None else min(best_load, loaded[0])
+        best_total = finished[0] if best_total is None else min(best_total, finished[0])
+        peak = max(peak, finished[1])
+    result.update({
+        "status": status,
+        "executed": executed,
+        "load_s": best_load,
+        "total_s": best_total,
+        "peak_rss_kb": peak,
+        "ips": None,
+    })
+    if status == "ok" and executed and best_total > best_load:
+        result["ips"] = executed / (best_total - best_load)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark interpret.py against its engines and interpret.1py')
+    parser.add_argument('--dir', default=os.path.join(tempfile.gettempdir(), "ipp_bench"),
+                        help='Directory with generated workloads, regenerated on every run')
+    parser.add_argument('--scale', type=int, default=1, help='Workload size multiplier')
+    parser.add_argument('--only', nargs='*', choices=sorted(generate.workloads), help='Run only these workloads')
+    parser.add_argument('--interpreters', nargs='*', choices=sorted(default_interpreters),
+                        default=sorted(default_interpreters), help='Interpreters to compare')
+    parser.add_argument('--extra', action='append', default=[], metavar='NAME=ARGS',
+                        help='Additional interpreter.py configuration, e.g. "nojit=--engine=classic"')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement, best is reported')
+    parser.add_argument('--timeout', type=float, default=120, help='Seconds before a run is abandoned')
+    parser.add_argument('--json', metavar='FILE', help='Append results as JSON lines to FILE, - for stdout')
+    arguments = parser.parse_args()
+
+    interpreters = {name: default_interpreters[name] for name in arguments.interpreters}
+    for extra in arguments.extra:
+        name, _, options = extra.partition("=")
+        interpreters[name] = [sys.executable, os.path.join(root, "interpret.py")] + options.split()
+
+    names = arguments.only or list(generate.workloads)
+    generate.generate(arguments.dir, arguments.scale, names)
+    json_output = None
+    if arguments.json == "-":
+        json_output = sys.stdout
+    elif arguments.json:
+        json_output = open(arguments.json, "a")
+
+    print("%-11s %-10s %-13s %8s %8s %12s %10s" % ("workload", "engine", "status", "load s", "total s",
+                                                  "instr/s", "peak kB"), file=sys.stderr)
+    for name in names:
+        base = os.path.join(arguments.dir, name)
+        executed = executed_instructions(base)
+        for interpreter, command in interpreters.items():
+            result = measure(name, interpreter, command, base, executed, arguments.repeat, arguments.timeout)
+            print("%-11s %-10s %-13s %8s %8s %12s %10d" % (
+                name, interpreter, result["status"],
+                "-" if result["load_s"] is None else "%.3f" % result["load_s"],
+                "-" if result["total_s"] is None else "%.3f" % result["total_s"],
+                "-" if result["ips"] is None else "%.0f" % result["ips"],
+                result["peak_rss_kb"]), file=sys.stderr)
+            if json_output:
+                json_output.write(json.dumps(result) + "\n")
+                json_output.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# runs a program on daemon.py with the same command line as interpret.py, --socket picks
+# the daemon, everything else except --source and --input is passed on, only light
+# modules are imported so a run costs little more than the program itself
+import hashlib
+import os
+import socket
+import struct
+import sys
+
+frame_header = struct.Struct(">cI")
+
+
+def default_socket():
+    return os.environ.get("IPP_DAEMON_SOCKET") or \
+        os.path.join(os.environ.get("TMPDIR", "/tmp"), "ipp_interpret-%d.sock" % os.getuid())
+
+
+def fail(message, code):
+    sys.stderr.write(message)
+    sys.exit(code)
+
+
+# --name value and --name=value, None when the option is not given
+def split_arguments(arguments):
+    found = {"--source": None, "--input": None, "--socket": None}
+    options = []
+    position = 0
+    while position < len(arguments):
+        argument = arguments[position]
+        name, equals, value = argument.partition("=")
+        if name in found:
+            value = value if equals else None
+            if not equals and position + 1 < len(arguments) and not arguments[position + 1].startswith("--"):
+                position += 1
+                value = arguments[position]
+            found[name] = value
+        else:
+            options.append(argument)
+        position += 1
+    return found, options
+
+
+def read_file(path):
+    try:
+        with open(path, "rb") as opened:
+            return opened.read()
+    except OSError:
+        fail("Cannot open source files\n", 11)
+
+
+def receive_exactly(connection, size):
+    data = bytearray()
+    while len(data) < size:
+        part = connection.recv(size - len(data))
+        if not part:
+            fail("Daemon closed the connection\n", 99)
+        data += part
+    return bytes(data)
+
+
+def main():
+    found, options = split_arguments(sys.argv[1:])
+    if found["--source"] is None and found["--input"] is None:
+        fail("Missing parameter or illegal combination\n", 10)
+    source = read_file(found["--source"]) if found["--source"] is not None else sys.stdin.buffer.read()
+    input_data = read_file(found["--input"]) if found["--input"] is not None else sys.stdin.buffer.read()
+    # program writes into a pipe on the daemon side, a terminal here still wants lines
+    if sys.stdout.isatty() and "--line-buffered" not in options:
+        options.append("--line-buffered")
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(found["--socket"] or default_socket())
+    except OSError:
+        fail("Cannot connect to the daemon, start it with daemon.py\n", 99)
+    # arguments cannot hold NUL bytes
+    request = "\0".join([hashlib.sha256(source).hexdigest(), os.getcwd(), str(len(input_data))] + options)
+    request = request.encode(errors="surrogateescape")
+    connection.sendall(frame_header.pack(b"r", len(request)) + request + input_data)
+
+    streams = {b"o": sys.stdout.buffer, b"e": sys.stderr.buffer}
+    while True:
+        kind, size = frame_header.unpack(receive_exactly(connection, frame_header.size))
+        data = receive_exactly(connection, size)
+        if kind == b"s":
+            connection.sendall(frame_header.pack(b"s", len(source)) + source)
+        elif kind == b"x":
+            break
+        else:
+            streams[kind].write(data)
+            streams[kind].flush()
+    connection.close()
+    sys.exit(int(data))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# keeps interpret.py imported in a long-lived process that serves programs over a unix
+# socket, every request runs in a child forked from it so globals start clean, client.py
+# is the command line side
+#
+# frames are a kind byte, a 4 byte big endian length and the data, a request is an "r"
+# frame with the sha256 of the source, the client's working directory, the size of the
+# program input and the interpret.py options separated by NUL bytes, the input follows
+# as it is, a source the daemon has not seen yet is asked for with an "s" frame and comes
+# back as one, the daemon answers with "o" (stdout) and "e" (stderr) frames while the
+# program runs and "x" with the exit code as text at the end
+import argparse
+import asyncio
+import collections
+import gc
+import hashlib
+import io
+import os
+import signal
+import struct
+import sys
+import traceback
+
+import interpret
+
+frame_header = struct.Struct(">cI")
+chunk_size = 65536
+hex_digits = set("0123456789abcdef")
+
+
+def default_socket():
+    return os.environ.get("IPP_DAEMON_SOCKET") or \
+        os.path.join(os.environ.get("TMPDIR", "/tmp"), "ipp_interpret-%d.sock" % os.getuid())
+
+
+def default_directory():
+    return os.environ.get("IPP_CACHE_DIR") or \
+        os.path.join(os.environ.get("TMPDIR", "/tmp"), "ipp_interpret-%d" % os.getuid())
+
+
+def frame(kind, data=b""):
+    return frame_header.pack(kind, len(data)) + data
+
+
+async def read_frame(reader):
+    kind, size = frame_header.unpack(await reader.readexactly(frame_header.size))
+    return kind, await reader.readexactly(size)
+
+
+# child side, never returns
+def run_request(source, directory, cwd, options, input_data, output_fd, error_fd):
+    code = 99
+    try:
+        # handlers and the wakeup fd belong to the event loop of the daemon
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        with os.fdopen(output_fd, "w") as output, os.fdopen(error_fd, "w") as errors:
+            sys.stdout = interpret.standard_output.stream = output
+            sys.stderr = interpret.error_output.stream = errors
+            sys.stdin = io.TextIOWrapper(io.BytesIO(input_data), encoding="utf-8")
+            # options that name files are relative to the directory of the client
+            try:
+                os.chdir(cwd)
+            except OSError:
+                interpret.Error.error_exit(interpret.eleven)
+            sys.argv = ["interpret.py", "--source", source, "--cache-dir", directory] + options
+            try:
+                interpret.main()
+                code = 0
+            except SystemExit as exit_request:
+                if exit_request.code is None:
+                    code = 0
+                else:
+                    code = exit_request.code if isinstance(exit_request.code, int) else 1
+            except BaseException:
+                traceback.print_exc(file=errors)
+            interpret.flush_outputs()
+    except SystemExit as exit_request:
+        code = exit_request.code
+    finally:
+        os._exit(code)
+
+
+async def open_pipe(fd):
+    reader = asyncio.StreamReader()
+    await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader),
+                                                        os.fdopen(fd, "rb", 0))
+    return reader
+
+
+async def relay(pipe, kind, writer):
+    while True:
+        data = await pipe.read(chunk_size)
+        if not data:
+            return
+        writer.write(frame(kind, data))
+        await writer.drain()
+
+
+class Daemon:
+    def __init__(self, directory, jobs, programs):
+        self.directory = directory
+        self.slots = asyncio.Semaphore(jobs)
+        self.served = 0
+        # hashes of the stored sources, least recently used first
+        self.programs = programs
+        self.stored = collections.OrderedDict()
+        self.running = collections.Counter()
+        found = [entry for entry in os.scandir(directory) if entry.name.endswith(".src")]
+        for entry in sorted(found, key=lambda entry: entry.stat().st_mtime):
+            self.stored[entry.name[:-len(".src")]] = None
+        self.evict()
+
+    def source_path(self, digest):
+        return os.path.join(self.directory, digest + ".src")
+
+    # a dropped source takes its .ippc file along, a later request sends it again, sources
+    # of running programs stay until they finish
+    def evict(self):
+        unused = [digest for digest in self.stored if not self.running[digest]]
+        for digest in unused[:max(len(self.stored) - self.programs, 0)]:
+            del self.stored[digest]
+            path = self.source_path(digest)
+            try:
+                with open(path, "rb") as source:
+                    compiled = interpret.cache_path(self.directory, source)
+                os.unlink(path)
+                os.unlink(compiled)
+            except OSError:
+                pass
+
+    # a source is stored under its hash once and later requests only send the hash
+    async def receive_source(self, digest, reader, writer):
+        if len(digest) != 64 or not set(digest) <= hex_digits:
+            return None
+        path = self.source_path(digest)
+        if digest in self.stored and os.path.exists(path):
+            self.stored.move_to_end(digest)
+            return path
+        writer.write(frame(b"s"))
+        await writer.drain()
+        kind, source = await read_frame(reader)
+        if kind != b"s" or hashlib.sha256(source).hexdigest() != digest:
+            return None
+        temporary = "%s.%d.tmp" % (path, os.getpid())
+        with open(temporary, "wb") as stored:
+            stored.write(source)
+        os.replace(temporary, path)
+        self.stored[digest] = None
+        self.evict()
+        return path
+
+    async def run(self, source, cwd, options, input_data, writer):
+        output_read, output_write = os.pipe()
+        error_read, error_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(output_read)
+            os.close(error_read)
+            run_request(source, self.directory, cwd, options, input_data, output_write, error_write)
+        os.close(output_write)
+        os.close(error_write)
+        try:
+            await asyncio.gather(relay(await open_pipe(output_read), b"o", writer),
+                                 relay(await open_pipe(error_read), b"e", writer))
+        except (ConnectionError, asyncio.CancelledError):
+            os.kill(pid, signal.SIGKILL)
+            raise
+        finally:
+            # pipes are at their end, the child is exiting or killed, waiting for it
+            # must not hold up the other clients
+            _, status = await asyncio.get_running_loop().run_in_executor(None, os.waitpid, pid, 0)
+        return os.waitstatus_to_exitcode(status)
+
+    async def serve(self, reader, writer):
+        try:
+            kind, request = await read_frame(reader)
+            if kind != b"r":
+                return
+            digest, cwd, size, *options = request.decode(errors="surrogateescape").split("\0")
+            input_data = await reader.readexactly(int(size))
+            async with self.slots:
+                self.running[digest] += 1
+                try:
+                    source = await self.receive_source(digest, reader, writer)
+                    if source is None:
+                        writer.write(frame(b"e", interpret.eleven.description.encode()))
+                        code = interpret.eleven.code
+                    else:
+                        code = await self.run(source, cwd, options, input_data, writer)
+                finally:
+                    self.running[digest] -= 1
+                    if not self.running[digest]:
+                        del self.running[digest]
+                    self.evict()
+            writer.write(frame(b"x", str(code).encode()))
+            await writer.drain()
+            self.served += 1
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            # client went away or sent something that is not a request
+            pass
+        finally:
+            writer.close()
+
+
+async def serve_forever(path, directory, jobs, programs):
+    daemon = Daemon(directory, jobs, programs)
+    if os.path.exists(path):
+        os.unlink(path)
+    # socket and stored programs are for this user only
+    previous = os.umask(0o077)
+    try:
+        server = await asyncio.start_unix_server(daemon.serve, path)
+    finally:
+        os.umask(previous)
+    created = os.stat(path).st_ino
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+    for number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(number, stopped.set)
+    print("Serving on %s, programs in %s" % (path, directory), file=sys.stderr)
+    async with server:
+        await stopped.wait()
+    # another daemon started on the same path since then owns it now
+    if os.path.exists(path) and os.stat(path).st_ino == created:
+        os.unlink(path)
+    print("Served %d requests" % daemon.served, file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve interpret.py runs over a unix socket')
+    parser.add_argument('--socket', default=default_socket(),
+                        help='Socket path, defaults to $IPP_DAEMON_SOCKET or a per-user path in $TMPDIR')
+    parser.add_argument('--dir', default=default_directory(),
+                        help='Directory for received sources and their .ippc files, defaults to $IPP_CACHE_DIR')
+    parser.add_argument('--jobs', type=int, default=len(os.sched_getaffinity(0)),
+                        help='Programs run at once, defaults to the available cores')
+    parser.add_argument('--programs', type=int, default=256,
+                        help='Sources kept in --dir, least recently used ones are removed')
+    arguments = parser.parse_args()
+
+    os.makedirs(arguments.dir, mode=0o700, exist_ok=True)
+    # state built during the imports stays shared with the children
+    gc.freeze()
+    asyncio.run(serve_forever(arguments.socket, os.path.abspath(arguments.dir), max(arguments.jobs, 1),
+                            max(arguments.programs, 1)))
+
+
+if __name__ == '__main__':
+    main()
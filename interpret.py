@@ -3,25 +3,53 @@ import sys
 import argparse
 import xml.etree.ElementTree as ET
 import re
+import os
+import io
+import hashlib
+import marshal
+import tempfile
+import gc
+import operator
+import time
+import json
+import array
+import struct
+import signal
+import resource
+import math
+import collections
 
 # Global variables
 global_frame = {}
 local_frame = []
 temp_frame = None
-input_file_split = []
+input_reader = None
 data_stack = []
 call_stack = []
 labels_ordered = {}
+global_names = {}
+local_names = {}
+local_template = []
+text_globals = set()
+text_locals = set()
+# frames dropped by CREATEFRAME and POPFRAME are emptied and kept for the next
+# CREATEFRAME, calls then do not allocate
+frame_pool = []
+frame_pool_limit = 4096
 
 current_instruction_index = 0
 done_instructions = 0
 
 
 class Argument:
+    __slots__ = ("val_type", "value", "order", "literal", "target")
+
     def __init__(self, val_type, value="", order=0):
         self.val_type = val_type
         self.value = value
         self.order = int(order)
+        self.literal = None
+        self.target = None
 
     # maybe fix
     def __eq__(self, other):
@@ -35,6 +63,8 @@ class Argument:
 
 
 class Instruction:
+    __slots__ = ("opcode", "arg_list", "order")
+
     def __init__(self, opcode, arg_list, order=0):
         if not opcode:
             Error.error_exit(thirtytwo)
@@ -59,6 +89,8 @@ class Instruction:
 
 
 class Variable:
+    __slots__ = ("name", "value", "var_type")
+
     def __init__(self, name=None, value=None, var_type=None):
         self.name = name
         self.value = value
@@ -72,6 +104,69 @@ class Variable:
         self.var_type = var_type
 
 
+# threaded engine keeps values unwrapped, IPPcode23 type is given by the python type
+class Nil:
+    __slots__ = ()
+
+    def __repr__(self):
+        return "nil"
+
+
+# string edited in place by CONCAT and SETCHAR, it is kept only in the variable it was
+# built in, reading that variable for anything else gives the flat str
+class Text:
+    __slots__ = ("chars", "flat")
+
+    def __init__(self, text):
+        self.chars = array.array(text_typecode)
+        self.chars.fromunicode(text)
+        self.flat = text
+
+    def text(self):
+        if self.flat is None:
+            self.flat = self.chars.tounicode()
+        return self.flat
+
+
+text_typecode = "w" if "w" in array.typecodes else "u"
+nil = Nil()
+uninitialized = object()
+value_types = {int: "int", float: "float", bool: "bool", str: "string", Nil: "nil", Text: "string"}
+
+
+# WRITE output is collected and written in bulk, every way out of the interpreter
+# goes through flush so nothing is lost or reordered against the exit code
+class OutputBuffer:
+    def __init__(self, stream, size=65536, line_buffered=False):
+        self.stream = stream
+        self.size = size
+        self.line_buffered = line_buffered
+        self.parts = []
+        self.pending = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.pending += len(text)
+        if self.pending >= self.size or (self.line_buffered and "\n" in text):
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            self.stream.write("".join(self.parts))
+            self.parts.clear()
+            self.pending = 0
+        self.stream.flush()
+
+
+standard_output = OutputBuffer(sys.stdout)
+error_output = OutputBuffer(sys.stderr)
+
+
+def flush_outputs():
+    standard_output.flush()
+    error_output.flush()
+
+
 class Error:
 
     def __init__(self, description, code):
@@ -82,6 +177,7 @@ class Error:
         return self.description
 
     def error_exit(self):
+        flush_outputs()
         sys.stderr.write(self.description)
         sys.exit(self.code)
 
@@ -99,12 +195,72 @@ fiftyfive = Error("Frame not exists\n", 55)
 fiftysix = Error("Missing value in variable or stack\n", 56)
 fiftyseven = Error("Wrong operand value, e.g. division by zero\n", 57)
 fiftyeight = Error("Wrong string manipulation\n", 58)
+sixty = Error("Resource budget exceeded\n", 60)
+
+
+# statistics options keep the order in which they were given
+class StatsItem(argparse.Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        items = getattr(namespace, "stats_items", None) or []
+        items.append((self.dest, values))
+        namespace.stats_items = items
 
 
 def argument_parser():
     parser = argparse.ArgumentParser(description='Basic XML to IPPCode23 interpret')
     parser.add_argument('--source', nargs='?', help='Source File')
     parser.add_argument('--input', nargs='?', help='Input File')
+    parser.add_argument('--engine', choices=["classic", "threaded"], default="threaded",
+                        help='Execution engine, classic matches opcodes on every step')
+    parser.add_argument('--cache-dir', default=os.environ.get("IPP_CACHE_DIR"),
+                        help='Directory for compiled programs (.ippc), defaults to $IPP_CACHE_DIR')
+    parser.add_argument('--compact', action='store_true',
+                        help='Keep the program as parallel arrays instead of instruction objects, threaded engine only')
+    parser.add_argument('--program-report', action='store_true',
+                        help='Write the bytes the loaded program takes per instruction to stderr')
+    parser.add_argument('--output-buffer', type=int, default=65536, metavar='SIZE',
+                        help='Characters of program output collected before writing, 0 writes at once')
+    parser.add_argument('--line-buffered', action='store_true',
+                        help='Write program output after every line, default when stdout is a terminal')
+    parser.add_argument('--optimize', type=int, choices=[0, 1, 2, 3], default=0, metavar='LEVEL',
+                        help='Threaded engine optimizations, 1 fuses common instruction pairs and threads jumps, '
+                             '2 also folds constants and drops unreachable code, 3 also compiles hot loops')
+    parser.add_argument('--tier2-threshold', type=int, default=tier2_threshold, metavar='COUNT',
+                        help='Times a label is reached before --optimize=3 compiles the code after it')
+    parser.add_argument('--optimize-report', action='store_true',
+                        help='Write instructions removed and folded by --optimize=2 and subroutines '
+                             'memoized by --memoize to stderr')
+    parser.add_argument('--memoize', action='store_true',
+                        help='Keep results of subroutines without side effects and skip repeated calls')
+    parser.add_argument('--memo-size', type=int, default=memo_size, metavar='ENTRIES',
+                        help='Results kept by --memoize, least recently used ones are dropped')
+    parser.add_argument('--stats', metavar='FILE', help='Write execution statistics (STATI) to FILE')
+    parser.add_argument('--stats-format', choices=["text", "json"], default="text",
+                        help='text writes the requested items one per line, json writes everything collected')
+    parser.add_argument('--insts', action=StatsItem, nargs=0, help='Statistics: executed instructions')
+    parser.add_argument('--hot', action=StatsItem, nargs=0, help='Statistics: order of the most executed instruction')
+    parser.add_argument('--vars', action=StatsItem, nargs=0, help='Statistics: most initialized variables at once')
+    parser.add_argument('--frequent', action=StatsItem, nargs=0, help='Statistics: most executed opcodes')
+    parser.add_argument('--print', action=StatsItem, metavar='STRING', help='Statistics: write STRING')
+    parser.add_argument('--eol', action=StatsItem, nargs=0, help='Statistics: write end of line')
+    parser.add_argument('--memo-hits', action=StatsItem, nargs=0, help='Statistics: calls answered by --memoize')
+    parser.add_argument('--memo-misses', action=StatsItem, nargs=0,
+                        help='Statistics: calls of memoized subroutines that ran')
+    parser.add_argument('--max-instructions', type=int, metavar='COUNT',
+                        help='Stop with exit code 60 after COUNT executed instructions')
+    parser.add_argument('--timeout', type=float, metavar='SECONDS',
+                        help='Stop with exit code 60 after SECONDS of wall time')
+    parser.add_argument('--max-call-depth', type=int, metavar='DEPTH',
+                        help='Stop with exit code 60 when calls or local frames nest deeper than DEPTH')
+    parser.add_argument('--max-stack', type=int, metavar='SIZE',
+                        help='Stop with exit code 60 when the data stack holds more than SIZE values')
+    parser.add_argument('--max-memory', type=int, metavar='MB',
+                        help='Stop with exit code 60 when the interpreter uses more than MB megabytes')
+    parser.add_argument('--trace', metavar='FILE', help='Record an execution trace and write it to FILE at the end')
+    parser.add_argument('--trace-size', type=int, default=65536, metavar='RECORDS',
+                        help='Trace ring buffer size, only the last RECORDS events are kept')
+    parser.add_argument('--trace-every', type=int, default=1, metavar='N',
+                        help='Record every Nth instruction, calls and frame changes are always recorded')
     arguments = parser.parse_args()
 
     control_list = []
@@ -114,70 +270,117 @@ def argument_parser():
         control_list.append(arguments.input)
     if len(control_list) == 0:
         Error.error_exit(ten)
+    if bool(arguments.stats) != bool(getattr(arguments, "stats_items", None)) and arguments.stats_format == "text":
+        Error.error_exit(ten)
+    if arguments.stats and arguments.engine == "classic":
+        Error.error_exit(ten)
+    if arguments.trace and (arguments.engine == "classic" or arguments.stats):
+        Error.error_exit(ten)
+    if arguments.memoize and (arguments.engine == "classic" or arguments.memo_size < 1):
+        Error.error_exit(ten)
+    if arguments.compact and arguments.engine == "classic":
+        Error.error_exit(ten)
 
-    return arguments.source, arguments.input
+    return arguments
 
 
-def split_to_lines(file):
-    if file:
-        try:
-            with open(file, "r") as in_file:
-                data_lines = [line.strip() for line in in_file.readlines()]
-                in_file.close()
-        except (Exception,):
-            Error.error_exit(eleven)
+# READ takes lines one by one from a buffered stream, nothing is read ahead
+class InputReader:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def read_line(self):
+        line = self.stream.readline()
+        if not line:
+            return None
+        return line.rstrip("\r\n")
 
-    else:
-        return None
-    return data_lines
+
+def open_input(file):
+    if not file:
+        return InputReader(sys.stdin)
+    try:
+        return InputReader(open(file, "r", buffering=1 << 16))
+    except OSError:
+        Error.error_exit(eleven)
 
 
 def check_xml_start(root):
     if root.tag != "program":
-        Error.error_exit(thirtytwo)
-    if root.attrib["language"].upper() != "IPPcode23".upper():
-        Error.error_exit(thirtytwo)
+        return False
+    if root.get("language", "").upper() != "IPPcode23".upper():
+        return False
     for att in root.attrib:
         if att not in ["language", "name", "description"]:
-            Error.error_exit(thirtytwo)
+            return False
+    return True
 
 
-def load_xml_to_list(root):
-    list_parsed = []
-    for child in root:
-        if child.tag != "instruction":
-            Error.error_exit(thirtytwo)
-        # instruction check
-        child_arguments = []
-        # maybe missing check xml arg order correct
-        for each in child:
-            for att in each.attrib:
-                if att != "type":
-                    Error.error_exit(thirtytwo)
-                matched = re.search("^arg([1-3])$", each.tag)
-                if matched:
-                    order_num = each.tag.replace("arg", "")
-                    argument = Argument(each.get("type"), each.text, order_num)
-                    child_arguments.append(argument)
-        child_arguments.sort(key=lambda argument: argument.order)
-        for index, argument in enumerate(child_arguments, start=1):
-            if argument.order < 1:
-                Error.error_exit(thirtytwo)
-            if argument.order != index:
-                Error.error_exit(thirtytwo)
-        instruction = Instruction(child.get("opcode"), child_arguments, child.get("order"))
-        list_parsed.append(instruction)
+argument_tag = re.compile("^arg([1-3])$")
+
+
+def instruction_from_element(element):
+    if element.tag != "instruction":
+        return None
+    for att in element.attrib:
+        if att not in ["order", "opcode"]:
+            return None
+    try:
+        order = int(element.get("order"))
+    except (TypeError, ValueError):
+        return None
+    if order < 1 or not element.get("opcode"):
+        return None
+    child_arguments = []
+    for each in element:
+        matched = argument_tag.match(each.tag)
+        if not matched or list(each.attrib) != ["type"]:
+            return None
+        child_arguments.append(Argument(each.get("type"), (each.text or "").strip(), matched.group(1)))
+    child_arguments.sort(key=lambda argument: argument.order)
+    for index, argument in enumerate(child_arguments, start=1):
+        if argument.order != index:
+            return None
+    return Instruction(element.get("opcode"), child_arguments, order)
+
+
+# instructions are validated as soon as their element is closed and the element is
+# dropped, structure errors are reported only after the whole document parsed so
+# that a not well formed document still ends with 31
+def parse_instructions(source):
+    malformed = False
+    root = None
+    depth = 0
+    try:
+        for event, element in ET.iterparse(source, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if depth == 1:
+                    root = element
+                    malformed = not check_xml_start(root)
+                continue
+            depth -= 1
+            if depth != 1:
+                continue
+            if not malformed:
+                instruction = instruction_from_element(element)
+                if instruction is None:
+                    malformed = True
+                else:
+                    yield instruction
+            element.clear()
+            root.remove(element)
+    except ET.ParseError:
+        Error.error_exit(thirtyone)
+    if malformed:
+        Error.error_exit(thirtytwo)
+
 
+def load_xml_to_list(source):
+    list_parsed = list(parse_instructions(source))
     list_parsed.sort(key=lambda instruction: instruction.order)
-    instruction_order_list = []
-    for instruction in list_parsed:
-        if instruction.order in instruction_order_list:
-            Error.error_exit(thirtytwo)
-        else:
-            instruction_order_list.append(instruction.order)
-        if instruction.order is None:
-            Error.error_exit(thirtytwo)
-        if int(instruction.order) < 1:
+    for previous, instruction in zip(list_parsed, list_parsed[1:]):
+        if previous.order == instruction.order:
             Error.error_exit(thirtytwo)
 
     return list_parsed
@@ -188,6 +391,9 @@ def symbol_check_and_return(symbol):
     output = None
     type_symbol = symbol.val_type
     val = symbol.value
+    # numbers were converted when the program was loaded
+    if type_symbol in ("int", "float"):
+        val = symbol.literal
     output = Variable(None, val, type_symbol)
     return output
 
@@ -219,7 +425,7 @@ def variable_check_and_return(variable):
                 to_return = local_frame[-1][name]
 
         case "TF":
-            if not temp_frame:
+            if temp_frame is None:
                 Error.error_exit(fiftyfive)
             if name not in temp_frame:
                 Error.error_exit(fiftyfour)
@@ -248,13 +454,15 @@ def execute_defvar(to_define):
                 Error.error_exit(fiftytwo)
 
         case "LF":
+            if len(local_frame) == 0:
+                Error.error_exit(fiftyfive)
             if name not in local_frame[-1]:
                 local_frame[-1][name] = Variable(name, None, None)
             else:
                 Error.error_exit(fiftytwo)
 
         case "TF":
-            if not temp_frame:
+            if temp_frame is None:
                 Error.error_exit(fiftyfive)
             if name not in temp_frame:
                 temp_frame[name] = Variable(name, None, None)
@@ -274,23 +482,26 @@ def no_argument_instruction(instruction):
 
     match instruction.opcode.upper():
         case "CREATEFRAME":
-            temp_frame = []
+            if temp_frame is not None:
+                temp_frame.clear()
+            elif frame_pool:
+                temp_frame = frame_pool.pop()
+            else:
+                temp_frame = {}
 
         case "PUSHFRAME":
-            if not temp_frame:
+            if temp_frame is None:
                 Error.error_exit(fiftyfive)
-
-            # fix this
-            for each in temp_frame:
-                name_in_temp = variable_check_and_return(each)
-                new_name = "LF@" + each.split("@")[1]
-                new_var = Variable(new_name, name_in_temp.value, name_in_temp.val_type)
-                local_frame.append(new_var)
+            # frame moves with its variables, nothing is copied
+            local_frame.append(temp_frame)
             temp_frame = None
 
         case "POPFRAME":
             if len(local_frame) == 0:
                 Error.error_exit(fiftyfive)
+            if temp_frame is not None and len(frame_pool) < frame_pool_limit:
+                temp_frame.clear()
+                frame_pool.append(temp_frame)
             temp_frame = local_frame.pop(-1)
 
         case "RETURN":
@@ -299,13 +510,12 @@ def no_argument_instruction(instruction):
             current_instruction_index = call_stack.pop(-1)
 
         case "BREAK":
-            sys.stderr.write("Current instruction count: " + str(done_instructions) + "\n")
+            error_output.write("Current instruction count: " + str(done_instructions) + "\n")
 
 
 def one_argument_instruction(instruction):
     global data_stack
     global current_instruction_index
-    global labels_ordered
     global call_stack
 
     if len(instruction.arg_list) != 1:
@@ -333,14 +543,14 @@ def one_argument_instruction(instruction):
 
         case "CALL":
             call_stack.append(current_instruction_index)
-            current_instruction_index = labels_ordered[str(instruction.arg_list[0].value)]
+            current_instruction_index = instruction.arg_list[0].target
 
         case "LABEL":
             pass
             # already done, check if done correctly
 
         case "JUMP":
-            current_instruction_index = labels_ordered[instruction.arg_list[0].value]
+            current_instruction_index = instruction.arg_list[0].target
 
         case "DPRINT":
             # symbol check format
@@ -349,7 +559,7 @@ def one_argument_instruction(instruction):
                 data_from_obj = obj_to_print.value
             else:
                 data_from_obj = symbol_check_and_return(instruction.arg_list[0])
-            sys.stderr.write(data_from_obj.value)
+            error_output.write(data_from_obj.value)
 
         case "WRITE":
             # symbol check format
@@ -358,8 +568,11 @@ def one_argument_instruction(instruction):
             else:
                 obj_to_write = symbol_check_and_return(instruction.arg_list[0])
 
-            data_from_obj = str(obj_to_write.value)
-            print(data_from_obj, end="")
+            if obj_to_write.var_type == "float":
+                data_from_obj = obj_to_write.value.hex()
+            else:
+                data_from_obj = str(obj_to_write.value)
+            standard_output.write(data_from_obj)
 
         case "EXIT":
             # check format
@@ -370,6 +583,7 @@ def one_argument_instruction(instruction):
 
             if int(instruction.arg_list[0].value) not in range(0, 50):
                 Error.error_exit(fiftyseven)
+            flush_outputs()
             sys.exit(int(instruction.arg_list[0].value))
 
 
@@ -400,6 +614,21 @@ def two_argument_instruction(instruction, input_data):
             destination = variable_check_and_return(instruction.arg_list[0].value)
             destination.update_value(converted, "string")
 
+        case "INT2FLOAT" | "FLOAT2INT":
+            destination = variable_check_and_return(instruction.arg_list[0].value)
+            if instruction.arg_list[1].val_type == "var":
+                to_convert = variable_check_and_return(instruction.arg_list[1].value)
+            else:
+                to_convert = symbol_check_and_return(instruction.arg_list[1])
+            if instruction.opcode.upper() == "INT2FLOAT":
+                if to_convert.var_type != "int":
+                    Error.error_exit(fiftythree)
+                destination.update_value(int_to_float(to_convert.value), "float")
+            else:
+                if to_convert.var_type != "float":
+                    Error.error_exit(fiftythree)
+                destination.update_value(float_to_int(to_convert.value), "int")
+
         case "STRLEN":
             destination = variable_check_and_return(instruction.arg_list[0].value)
             if instruction.arg_list[1].val_type == "var":
@@ -444,10 +673,8 @@ def two_argument_instruction(instruction, input_data):
             # TODO finish type conversion and input reading
             # mozno double pokus o read z konzoly
             destination = variable_check_and_return(instruction.arg_list[0].value)
-            #fix reading from input_data
-            try:
-                input_value = input_data.pop(0)
-            except (Exception,):
+            input_value = input_data.read_line()
+            if input_value is None:
                 Error.error_exit(fiftyfour)
 
             # check for type from argument 1 and convert input_value to that type (bool, string, int)
@@ -462,6 +689,11 @@ def two_argument_instruction(instruction, input_data):
                 except (Exception,):
                     Error.error_exit(fiftythree)
                 destination.update_value(input_value, "int")
+            elif str(instruction.arg_list[1].value) == "float":
+                input_value = float_or_nil(input_value)
+                if input_value is nil:
+                    Error.error_exit(fiftythree)
+                destination.update_value(input_value, "float")
             elif str(instruction.arg_list[1].value) == "string":
                 try:
                     input_value = str(input_value)
@@ -487,8 +719,8 @@ def three_argument_instruction(instruction):
                 second = variable_check_and_return(instruction.arg_list[2].value)
             else:
                 second = symbol_check_and_return(instruction.arg_list[2])
-            if first.var_type == "int" and second.var_type == "int":
-                destination.update_value(first.value + second.value, "int")
+            if first.var_type == second.var_type and first.var_type in ("int", "float"):
+                destination.update_value(first.value + second.value, first.var_type)
             else:
                 Error.error_exit(fiftythree)
 
@@ -502,8 +734,8 @@ def three_argument_instruction(instruction):
                 second = variable_check_and_return(instruction.arg_list[2].value)
             else:
                 second = symbol_check_and_return(instruction.arg_list[2])
-            if first.var_type == "int" and second.var_type == "int":
-                destination.update_value(int(first.value) - int(second.value), "int")
+            if first.var_type == second.var_type and first.var_type in ("int", "float"):
+                destination.update_value(first.value - second.value, first.var_type)
             else:
                 Error.error_exit(fiftythree)
 
@@ -517,8 +749,8 @@ def three_argument_instruction(instruction):
                 second = variable_check_and_return(instruction.arg_list[2].value)
             else:
                 second = symbol_check_and_return(instruction.arg_list[2])
-            if first.var_type == "int" and second.var_type == "int":
-                destination.update_value(int(first.value) * int(second.value), "int")
+            if first.var_type == second.var_type and first.var_type in ("int", "float"):
+                destination.update_value(first.value * second.value, first.var_type)
             else:
                 Error.error_exit(fiftythree)
 
@@ -536,9 +768,26 @@ def three_argument_instruction(instruction):
                 # maybe bad error
 
             if first.var_type == "int" and second.var_type == "int":
-                if int(second.value) == 0:
+                if second.value == 0:
                     Error.error_exit(fiftyseven)
-                destination.update_value(int(first.value) / int(second.value), "int")
+                destination.update_value(first.value // second.value, "int")
+            else:
+                Error.error_exit(fiftythree)
+
+        case "DIV":
+            destination = variable_check_and_return(instruction.arg_list[0].value)
+            if instruction.arg_list[1].val_type == "var":
+                first = variable_check_and_return(instruction.arg_list[1].value)
+            else:
+                first = symbol_check_and_return(instruction.arg_list[1])
+            if instruction.arg_list[2].val_type == "var":
+                second = variable_check_and_return(instruction.arg_list[2].value)
+            else:
+                second = symbol_check_and_return(instruction.arg_list[2])
+            if first.var_type == "float" and second.var_type == "float":
+                if second.value == 0:
+                    Error.error_exit(fiftyseven)
+                destination.update_value(first.value / second.value, "float")
             else:
                 Error.error_exit(fiftythree)
 
@@ -725,7 +974,7 @@ def three_argument_instruction(instruction):
                     second = symbol_check_and_return(instruction.arg_list[2])
 
                 if first.value == second.value:
-                    current_instruction_index = labels_ordered[instruction.arg_list[0].value]
+                    current_instruction_index = instruction.arg_list[0].target
             else:
                 Error.error_exit(fiftythree)
 
@@ -741,34 +990,213 @@ def three_argument_instruction(instruction):
                     second = symbol_check_and_return(instruction.arg_list[2])
 
                 if first.value != second.value:
-                    current_instruction_index = labels_ordered[str(instruction.arg_list[0].value)]
+                    current_instruction_index = instruction.arg_list[0].target
 
             else:
                 Error.error_exit(fiftythree)
 
 
+escape_sequence = re.compile(r"\\([0-9]{3})")
+
+
+def decode_escapes(text):
+    return escape_sequence.sub(lambda matched: chr(int(matched.group(1))), text)
+
+
+# hexadecimal as written by float.hex() or decimal, nothing else that float() takes
+# (inf, nan, 1_0, spaces), fromhex alone would read 1.5 or abc as hex digits
+hex_float = re.compile(r"[+-]?0[xX]([0-9a-fA-F]+\.?[0-9a-fA-F]*|\.[0-9a-fA-F]+)([pP][+-]?[0-9]+)?")
+decimal_float = re.compile(r"[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]+)?")
+
+
+def parse_float(text):
+    if hex_float.fullmatch(text):
+        return float.fromhex(text)
+    if decimal_float.fullmatch(text):
+        value = float(text)
+        # a decimal past the largest float gives inf instead of failing like fromhex
+        if value in (math.inf, -math.inf):
+            raise OverflowError(text)
+        return value
+    raise ValueError(text)
+
+
+def convert_literal(argument):
+    text = argument.value or ""
+    match argument.val_type:
+        case "int":
+            try:
+                return int(text, 0)
+            except ValueError:
+                try:
+                    return int(text)
+                except ValueError:
+                    Error.error_exit(thirtytwo)
+        case "float":
+            try:
+                return parse_float(text)
+            except (ValueError, OverflowError):
+                Error.error_exit(thirtytwo)
+        case "bool":
+            if text not in ("true", "false"):
+                Error.error_exit(thirtytwo)
+            return text == "true"
+        case "nil":
+            if text != "nil":
+                Error.error_exit(thirtytwo)
+            return nil
+    return decode_escapes(text)
+
+
+# every constant operand is converted once, equal constants share one entry
+def build_literal_table(instruction_list):
+    literal_table = {}
+    for instruction in instruction_list:
+        for argument in instruction.arg_list:
+            if argument.val_type not in ("int", "float", "bool", "string", "nil"):
+                continue
+            key = (argument.val_type, argument.value)
+            if key not in literal_table:
+                literal_table[key] = convert_literal(argument)
+            argument.literal = literal_table[key]
+            if argument.val_type == "string":
+                argument.value = argument.literal
+    return literal_table
+
+
+# labels are collected and every label operand is linked to the index of its label
+# in one pass, jumps then use argument.target directly
 def check_labels(list_to_check):
-    global labels_ordered
-    labels = []
-    for instruction in list_to_check:
-        if instruction.opcode.upper() == "LABEL":
+    labels_ordered.clear()
+    references = []
+    for index, instruction in enumerate(list_to_check):
+        if instruction.opcode == "LABEL":
+            if len(instruction.arg_list) != 1 or instruction.arg_list[0].val_type != "label":
+                Error.error_exit(thirtytwo)
             label_name = instruction.arg_list[0].value
-            if label_name in labels:
+            if label_name in labels_ordered:
                 Error.error_exit(fiftytwo)
-            labels.append(label_name)
-            labels_ordered[label_name] = list_to_check.index(instruction)
-    for instruction in list_to_check:
-        if instruction.opcode.upper() != "LABEL":
+            labels_ordered[label_name] = index
+            instruction.arg_list[0].target = index
+        else:
             for argument in instruction.arg_list:
                 if argument.val_type == "label":
-                    if argument.value not in labels:
-                        Error.error_exit(fiftytwo)
+                    references.append(argument)
+    for argument in references:
+        if argument.value not in labels_ordered:
+            Error.error_exit(fiftytwo)
+        argument.target = labels_ordered[argument.value]
+
+
+# compiled program cache, file is the magic followed by the marshalled arrays and tables
+# of the compact program, name is hash of the interpreter itself and of the source so
+# any change invalidates it
+cache_magic = b"IPPC\x04"
+
+
+def interpreter_digest():
+    try:
+        with open(__file__, "rb") as own_source:
+            return hashlib.file_digest(own_source, "sha256").digest()
+    except OSError:
+        return b""
+
+
+def cache_path(cache_dir, source):
+    digest = hashlib.sha256(interpreter_digest())
+    digest.update(hashlib.file_digest(source, "sha256").digest())
+    return os.path.join(cache_dir, digest.hexdigest() + ".ippc")
+
+
+def save_compiled(path, program):
+    if not isinstance(program, CompactProgram):
+        program = compact_program(program)
+    arrays = [(values.typecode, values.tobytes()) for values in
+              (program.opcodes, program.orders, program.first_operand, program.kinds, program.operands)]
+    literals = [None if literal is nil else literal for literal in program.literals]
+    data = cache_magic + marshal.dumps((arrays, program.opcode_names, program.kind_names, program.names,
+                                        program.literal_texts, literals, program.labels))
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(handle, "wb") as cache_file:
+            cache_file.write(data)
+        os.replace(temporary, path)
+    except OSError:
+        pass
+
+
+# gives the compact program itself or the instruction list built from it
+def load_compiled(path, compact=False):
+    try:
+        with open(path, "rb") as cache_file:
+            data = cache_file.read()
+    except OSError:
+        return None
+    if not data.startswith(cache_magic):
+        return None
+    program = CompactProgram()
+    try:
+        arrays, opcode_names, kind_names, names, literal_texts, literals, labels = \
+            marshal.loads(data[len(cache_magic):])
+        program.opcodes, program.orders, program.first_operand, program.kinds, program.operands = \
+            [array.array(typecode, values) for typecode, values in arrays]
+    except (EOFError, ValueError, TypeError):
+        return None
+    program.opcode_names = opcode_names
+    program.kind_names = kind_names
+    program.names = names
+    program.literal_texts = literal_texts
+    # nil is the only literal marshalled as None
+    program.literals = [nil if literal is None else literal for literal in literals]
+    program.labels = labels
+    labels_ordered.clear()
+    labels_ordered.update(labels)
+    return program if compact else list(program)
+
+
+def load_stream(source, compact=False):
+    if compact:
+        return load_compact_stream(source)
+    instruction_list = load_xml_to_list(source)
+    build_literal_table(instruction_list)
+    check_labels(instruction_list)
+    return instruction_list
 
 
-def interpret_code(instruction_list, input_data):
+def load_program(source_file, cache_dir=None, compact=False):
+    if source_file:
+        try:
+            source = open(source_file, "rb")
+        except OSError:
+            Error.error_exit(eleven)
+    elif cache_dir:
+        source = io.BytesIO(sys.stdin.buffer.read())
+    else:
+        source = sys.stdin.buffer
+
+    path = None
+    if cache_dir:
+        path = cache_path(cache_dir, source)
+        instruction_list = load_compiled(path, compact)
+        if instruction_list is not None:
+            return instruction_list
+        source.seek(0)
+
+    instruction_list = load_stream(source, compact)
+    if source is not sys.stdin.buffer:
+        source.close()
+    if path:
+        save_compiled(path, instruction_list)
+    return instruction_list
+
+
+def interpret_code(instruction_list, input_data, limit=None):
     global current_instruction_index
     global done_instructions
     while current_instruction_index < len(instruction_list):
+        if limit is not None and done_instructions >= limit:
+            raise BudgetExceeded("instructions", limit, done_instructions)
         instruction = instruction_list[current_instruction_index]
         current_instruction_index += 1
         done_instructions += 1
@@ -780,10 +1208,10 @@ def interpret_code(instruction_list, input_data):
                               "LABEL", "JUMP", "DPRINT", "WRITE", "EXIT"):
             one_argument_instruction(instruction)
 
-        elif name_to_call in ("MOVE", "INT2CHAR", "STRLEN", "TYPE", "NOT", "READ"):
+        elif name_to_call in ("MOVE", "INT2CHAR", "INT2FLOAT", "FLOAT2INT", "STRLEN", "TYPE", "NOT", "READ"):
             two_argument_instruction(instruction, input_data)
 
-        elif name_to_call in ("ADD", "SUB", "MUL", "IDIV", "LT", "GT", "EQ", "AND", "OR", "NOT",
+        elif name_to_call in ("ADD", "SUB", "MUL", "IDIV", "DIV", "LT", "GT", "EQ", "AND", "OR", "NOT",
                               "STRI2INT", "CONCAT", "GETCHAR", "SETCHAR", "JUMPIFEQ", "JUMPIFNEQ"):
             three_argument_instruction(instruction)
 
@@ -791,42 +1219,3030 @@ def interpret_code(instruction_list, input_data):
             Error.error_exit(thirtytwo)
 
 
-def main():
-    global input_file_split
-    source_file, input_file = argument_parser()
+# threaded engine, every instruction is decoded once into a handler with its operands
+# already bound, handler returns index of the next instruction to run
+class DebugBreak(Exception):
+    def __init__(self, resume):
+        self.resume = resume
 
-    if source_file:
-        source_file_split = split_to_lines(source_file)
+
+def check_operands(instruction, signature):
+    if len(instruction.arg_list) != len(signature):
+        Error.error_exit(thirtytwo)
+    for argument, kind in zip(instruction.arg_list, signature):
+        match kind:
+            case "var" | "label" | "type":
+                if argument.val_type != kind:
+                    Error.error_exit(thirtytwo)
+            case "symb":
+                if argument.val_type not in ("var", "int", "float", "bool", "string", "nil"):
+                    Error.error_exit(thirtytwo)
+
+
+def slot_index(table, name):
+    if name not in table:
+        table[name] = len(table)
+    return table[name]
+
+
+# variable operand is resolved once into frame kind and slot index, LF and TF share
+# slot numbering so PUSHFRAME/POPFRAME only move the whole frame
+def resolve_variable(argument):
+    frame, _, name = argument.value.partition("@")
+    if not name:
+        Error.error_exit(thirtytwo)
+    match frame:
+        case "GF":
+            return frame, slot_index(global_names, name)
+        case "LF" | "TF":
+            return frame, slot_index(local_names, name)
+    Error.error_exit(thirtytwo)
+
+
+# slot holds None when the variable was not defined, uninitialized after DEFVAR,
+# otherwise the value itself
+def missing_value(value):
+    if value is None:
+        Error.error_exit(fiftyfour)
+    Error.error_exit(fiftysix)
+
+
+def make_lookup(argument):
+    frame, slot = resolve_variable(argument)
+    match frame:
+        case "GF":
+            slots = global_frame
+
+            def lookup():
+                value = slots[slot]
+                if value is None:
+                    Error.error_exit(fiftyfour)
+                return value
+
+        case "LF":
+            frames = local_frame
+
+            def lookup():
+                if len(frames) == 0:
+                    Error.error_exit(fiftyfive)
+                value = frames[-1][slot]
+                if value is None:
+                    Error.error_exit(fiftyfour)
+                return value
+
+        case _:
+            def lookup():
+                if temp_frame is None:
+                    Error.error_exit(fiftyfive)
+                value = temp_frame[slot]
+                if value is None:
+                    Error.error_exit(fiftyfour)
+                return value
+    return lookup
+
+
+def make_store(argument):
+    frame, slot = resolve_variable(argument)
+    match frame:
+        case "GF":
+            slots = global_frame
+
+            def store(value):
+                if slots[slot] is None:
+                    Error.error_exit(fiftyfour)
+                slots[slot] = value
+
+        case "LF":
+            frames = local_frame
+
+            def store(value):
+                if len(frames) == 0:
+                    Error.error_exit(fiftyfive)
+                target = frames[-1]
+                if target[slot] is None:
+                    Error.error_exit(fiftyfour)
+                target[slot] = value
+
+        case _:
+            def store(value):
+                if temp_frame is None:
+                    Error.error_exit(fiftyfive)
+                if temp_frame[slot] is None:
+                    Error.error_exit(fiftyfour)
+                temp_frame[slot] = value
+    return store
+
+
+def make_symbol_reader(argument, keep_text=False):
+    if argument.val_type != "var":
+        constant = argument.literal
+
+        def read_constant():
+            return constant
+        return read_constant
+
+    frame, slot = resolve_variable(argument)
+    match frame:
+        case "GF":
+            slots = global_frame
+
+            def read_variable():
+                value = slots[slot]
+                if value is None or value is uninitialized:
+                    missing_value(value)
+                return value
+
+        case "LF":
+            frames = local_frame
+
+            def read_variable():
+                if len(frames) == 0:
+                    Error.error_exit(fiftyfive)
+                value = frames[-1][slot]
+                if value is None or value is uninitialized:
+                    missing_value(value)
+                return value
+
+        case _:
+            def read_variable():
+                if temp_frame is None:
+                    Error.error_exit(fiftyfive)
+                value = temp_frame[slot]
+                if value is None or value is uninitialized:
+                    missing_value(value)
+                return value
+
+    if keep_text or slot not in (text_globals if frame == "GF" else text_locals):
+        return read_variable
+
+    def read_text_variable():
+        value = read_variable()
+        if type(value) is Text:
+            return value.text()
+        return value
+    return read_text_variable
+
+
+def same_variable(first, second):
+    return first.val_type == "var" and second.val_type == "var" and first.value == second.value
+
+
+def values_equal(first, second):
+    if first is nil or second is nil:
+        return first is second
+    if type(first) is not type(second):
+        Error.error_exit(fiftythree)
+    return first == second
+
+
+def write_text(value):
+    if type(value) is str:
+        return value
+    if type(value) is bool:
+        return "true" if value else "false"
+    if value is nil:
+        return ""
+    if type(value) is float:
+        return value.hex()
+    return str(value)
+
+
+# local frames end with the list of slots their DEFVARs filled, a dropped frame is
+# emptied through it so calls cost the same whatever the number of local names
+def release_frame(frame):
+    defined = frame[-1]
+    for slot in defined:
+        frame[slot] = None
+    defined.clear()
+    if len(frame_pool) < frame_pool_limit:
+        frame_pool.append(frame)
+
+
+def decode_createframe(args, following):
+    empty_frame = local_template
+    pool = frame_pool
+
+    def op():
+        global temp_frame
+        frame = temp_frame
+        if frame is not None:
+            # old TF is referenced from nowhere else, it becomes the new one
+            defined = frame[-1]
+            for slot in defined:
+                frame[slot] = None
+            defined.clear()
+        elif pool:
+            temp_frame = pool.pop()
+        else:
+            temp_frame = empty_frame + [[]]
+        return following
+    return op
+
+
+def decode_pushframe(args, following):
+    def op():
+        global temp_frame
+        if temp_frame is None:
+            Error.error_exit(fiftyfive)
+        local_frame.append(temp_frame)
+        temp_frame = None
+        return following
+    return op
+
+
+def decode_popframe(args, following):
+    def op():
+        global temp_frame
+        if len(local_frame) == 0:
+            Error.error_exit(fiftyfive)
+        if temp_frame is not None:
+            release_frame(temp_frame)
+        temp_frame = local_frame.pop()
+        return following
+    return op
+
+
+def decode_return(args, following):
+    def op():
+        if len(call_stack) == 0:
+            Error.error_exit(fiftysix)
+        return call_stack.pop()
+    return op
+
+
+def decode_break(args, following):
+    def op():
+        raise DebugBreak(following)
+    return op
+
+
+def decode_defvar(args, following):
+    frame, slot = resolve_variable(args[0])
+    frames = local_frame
+
+    def op():
+        match frame:
+            case "GF":
+                if global_frame[slot] is not None:
+                    Error.error_exit(fiftytwo)
+                global_frame[slot] = uninitialized
+                return following
+            case "LF":
+                if len(frames) == 0:
+                    Error.error_exit(fiftyfive)
+                target = frames[-1]
+            case _:
+                if temp_frame is None:
+                    Error.error_exit(fiftyfive)
+                target = temp_frame
+        if target[slot] is not None:
+            Error.error_exit(fiftytwo)
+        target[slot] = uninitialized
+        target[-1].append(slot)
+        return following
+    return op
+
+
+def decode_move(args, following):
+    store = make_store(args[0])
+    source = make_symbol_reader(args[1])
+
+    def op():
+        store(source())
+        return following
+    return op
+
+
+def decode_pushs(args, following):
+    source = make_symbol_reader(args[0])
+    push = data_stack.append
+
+    def op():
+        push(source())
+        return following
+    return op
+
+
+def decode_pops(args, following):
+    store = make_store(args[0])
+    stack = data_stack
+
+    def op():
+        if len(stack) == 0:
+            Error.error_exit(fiftysix)
+        store(stack.pop())
+        return following
+    return op
+
+
+def decode_call(args, following):
+    target = args[0].target
+
+    def op():
+        call_stack.append(following)
+        return target
+    return op
+
+
+def decode_label(args, following):
+    def op():
+        return following
+    return op
+
+
+def decode_jump(args, following):
+    target = args[0].target
+
+    def op():
+        return target
+    return op
+
+
+def decode_conditional_jump(args, following, when_equal):
+    target = args[0].target
+    first = make_symbol_reader(args[1])
+    second = make_symbol_reader(args[2])
+
+    def op():
+        if values_equal(first(), second()) == when_equal:
+            return target
+        return following
+    return op
+
+
+def decode_jumpifeq(args, following):
+    return decode_conditional_jump(args, following, True)
+
+
+def decode_jumpifneq(args, following):
+    return decode_conditional_jump(args, following, False)
+
+
+def decode_exit(args, following):
+    source = make_symbol_reader(args[0])
+
+    def op():
+        code = source()
+        if type(code) is not int:
+            Error.error_exit(fiftythree)
+        if code not in range(0, 50):
+            Error.error_exit(fiftyseven)
+        flush_outputs()
+        sys.exit(code)
+    return op
+
+
+def decode_write(args, following):
+    source = make_symbol_reader(args[0])
+    write = standard_output.write
+
+    def op():
+        write(write_text(source()))
+        return following
+    return op
+
+
+def decode_dprint(args, following):
+    source = make_symbol_reader(args[0])
+    write = error_output.write
+
+    def op():
+        write(write_text(source()))
+        return following
+    return op
+
+
+def decode_arithmetic(operation):
+    def decode(args, following):
+        store = make_store(args[0])
+        first = make_symbol_reader(args[1])
+        second = make_symbol_reader(args[2])
+
+        def op():
+            left = first()
+            right = second()
+            if type(left) is not int or type(right) is not int:
+                if type(left) is not float or type(right) is not float:
+                    Error.error_exit(fiftythree)
+            store(operation(left, right))
+            return following
+        return op
+    return decode
+
+
+# IDIV takes only int operands, DIV only float
+def decode_division(operation, kind):
+    def decode(args, following):
+        store = make_store(args[0])
+        first = make_symbol_reader(args[1])
+        second = make_symbol_reader(args[2])
+
+        def op():
+            left = first()
+            right = second()
+            if type(left) is not kind or type(right) is not kind:
+                Error.error_exit(fiftythree)
+            store(operation(left, right))
+            return following
+        return op
+    return decode
+
+
+def integer_division(first, second):
+    if second == 0:
+        Error.error_exit(fiftyseven)
+    return first // second
+
+
+def float_division(first, second):
+    if second == 0:
+        Error.error_exit(fiftyseven)
+    return first / second
+
+
+def int_to_float(value):
+    if type(value) is not int:
+        Error.error_exit(fiftythree)
+    try:
+        return float(value)
+    except OverflowError:
+        Error.error_exit(fiftyseven)
+
+
+def float_to_int(value):
+    if type(value) is not float:
+        Error.error_exit(fiftythree)
+    try:
+        return int(value)
+    except (OverflowError, ValueError):
+        Error.error_exit(fiftyseven)
+
+
+def float_or_nil(text):
+    try:
+        return parse_float(text)
+    except (ValueError, OverflowError):
+        return nil
+
+
+def decode_conversion(convert):
+    def decode(args, following):
+        store = make_store(args[0])
+        source = make_symbol_reader(args[1])
+
+        def op():
+            store(convert(source()))
+            return following
+        return op
+    return decode
+
+
+def decode_relation(operation):
+    def decode(args, following):
+        store = make_store(args[0])
+        first = make_symbol_reader(args[1])
+        second = make_symbol_reader(args[2])
+
+        def op():
+            left = first()
+            right = second()
+            if type(left) is not type(right) or left is nil:
+                Error.error_exit(fiftythree)
+            store(operation(left, right))
+            return following
+        return op
+    return decode
+
+
+def decode_eq(args, following):
+    store = make_store(args[0])
+    first = make_symbol_reader(args[1])
+    second = make_symbol_reader(args[2])
+
+    def op():
+        store(values_equal(first(), second()))
+        return following
+    return op
+
+
+def decode_logic(operation):
+    def decode(args, following):
+        store = make_store(args[0])
+        first = make_symbol_reader(args[1])
+        second = make_symbol_reader(args[2])
+
+        def op():
+            left = first()
+            right = second()
+            if type(left) is not bool or type(right) is not bool:
+                Error.error_exit(fiftythree)
+            store(operation(left, right))
+            return following
+        return op
+    return decode
+
+
+def decode_not(args, following):
+    store = make_store(args[0])
+    source = make_symbol_reader(args[1])
+
+    def op():
+        value = source()
+        if type(value) is not bool:
+            Error.error_exit(fiftythree)
+        store(not value)
+        return following
+    return op
+
+
+def decode_int2char(args, following):
+    store = make_store(args[0])
+    source = make_symbol_reader(args[1])
+
+    def op():
+        value = source()
+        if type(value) is not int:
+            Error.error_exit(fiftythree)
+        try:
+            converted = chr(value)
+        except (ValueError, OverflowError):
+            Error.error_exit(fiftyeight)
+        store(converted)
+        return following
+    return op
+
+
+def decode_stri2int(args, following):
+    store = make_store(args[0])
+    first = make_symbol_reader(args[1], keep_text=True)
+    second = make_symbol_reader(args[2])
+
+    def op():
+        text = first()
+        position = second()
+        if type(text) is Text:
+            text = text.chars
+        elif type(text) is not str:
+            Error.error_exit(fiftythree)
+        if type(position) is not int:
+            Error.error_exit(fiftythree)
+        if position < 0 or position >= len(text):
+            Error.error_exit(fiftyeight)
+        store(ord(text[position]))
+        return following
+    return op
+
+
+def decode_concat(args, following):
+    store = make_store(args[0])
+    second = make_symbol_reader(args[2])
+    if not same_variable(args[0], args[1]):
+        first = make_symbol_reader(args[1])
+
+        def op():
+            left = first()
+            right = second()
+            if type(left) is not str or type(right) is not str:
+                Error.error_exit(fiftythree)
+            store(left + right)
+            return following
+        return op
+
+    # appending to the destination itself, string is turned into Text once and grows in place
+    current = make_symbol_reader(args[1], keep_text=True)
+
+    def op():
+        left = current()
+        right = second()
+        if type(right) is not str:
+            Error.error_exit(fiftythree)
+        if type(left) is Text:
+            left.chars.fromunicode(right)
+            left.flat = None
+        elif type(left) is str:
+            text = Text(left)
+            text.chars.fromunicode(right)
+            text.flat = None
+            store(text)
+        else:
+            Error.error_exit(fiftythree)
+        return following
+    return op
+
+
+def decode_strlen(args, following):
+    store = make_store(args[0])
+    source = make_symbol_reader(args[1], keep_text=True)
+
+    def op():
+        text = source()
+        if type(text) is Text:
+            text = text.chars
+        elif type(text) is not str:
+            Error.error_exit(fiftythree)
+        store(len(text))
+        return following
+    return op
+
+
+def decode_getchar(args, following):
+    store = make_store(args[0])
+    first = make_symbol_reader(args[1], keep_text=True)
+    second = make_symbol_reader(args[2])
+
+    def op():
+        text = first()
+        position = second()
+        if type(text) is Text:
+            text = text.chars
+        elif type(text) is not str:
+            Error.error_exit(fiftythree)
+        if type(position) is not int:
+            Error.error_exit(fiftythree)
+        if position < 0 or position >= len(text):
+            Error.error_exit(fiftyeight)
+        store(text[position])
+        return following
+    return op
+
+
+def decode_setchar(args, following):
+    current = make_symbol_reader(args[0], keep_text=True)
+    store = make_store(args[0])
+    first = make_symbol_reader(args[1])
+    second = make_symbol_reader(args[2])
+
+    def op():
+        text = current()
+        position = first()
+        replacement = second()
+        if type(text) is str:
+            text = Text(text)
+            store(text)
+        if type(text) is not Text or type(position) is not int or type(replacement) is not str:
+            Error.error_exit(fiftythree)
+        if position < 0 or position >= len(text.chars) or replacement == "":
+            Error.error_exit(fiftyeight)
+        text.chars[position] = replacement[0]
+        text.flat = None
+        return following
+    return op
+
+
+def decode_type(args, following):
+    store = make_store(args[0])
+    if args[1].val_type == "var":
+        source = make_lookup(args[1])
     else:
-        # check if reading is correct
-        source_file_split = [line.strip for line in sys.stdin]
+        source = make_symbol_reader(args[1])
+
+    def op():
+        value = source()
+        if value is uninitialized:
+            store("")
+        else:
+            store(value_types[type(value)])
+        return following
+    return op
+
+
+def decode_read(args, following):
+    store = make_store(args[0])
+    wanted = args[1].value
+
+    def op():
+        input_value = input_reader.read_line()
+        if input_value is None:
+            store(nil)
+            return following
+        match wanted:
+            case "int":
+                try:
+                    store(int(input_value))
+                except ValueError:
+                    store(nil)
+            case "float":
+                store(float_or_nil(input_value))
+            case "bool":
+                store(input_value.upper() == "TRUE")
+            case _:
+                store(input_value)
+        return following
+    return op
+
+
+# STACK extension, operands come from the data stack, the top is the second operand
+def decode_clears(args, following):
+    clear = data_stack.clear
+
+    def op():
+        clear()
+        return following
+    return op
+
+
+def decode_stack_arithmetic(operation):
+    def decode(args, following):
+        stack = data_stack
+        pop = stack.pop
+        push = stack.append
+
+        def op():
+            if len(stack) < 2:
+                Error.error_exit(fiftysix)
+            right = pop()
+            left = pop()
+            if type(left) is not int or type(right) is not int:
+                if type(left) is not float or type(right) is not float:
+                    Error.error_exit(fiftythree)
+            push(operation(left, right))
+            return following
+        return op
+    return decode
+
+
+def decode_stack_division(operation, kind):
+    def decode(args, following):
+        stack = data_stack
+        pop = stack.pop
+        push = stack.append
 
-    if input_file:
-        input_file_split = split_to_lines(input_file)
+        def op():
+            if len(stack) < 2:
+                Error.error_exit(fiftysix)
+            right = pop()
+            left = pop()
+            if type(left) is not kind or type(right) is not kind:
+                Error.error_exit(fiftythree)
+            push(operation(left, right))
+            return following
+        return op
+    return decode
+
+
+def decode_stack_conversion(convert):
+    def decode(args, following):
+        stack = data_stack
+
+        def op():
+            if not stack:
+                Error.error_exit(fiftysix)
+            stack[-1] = convert(stack[-1])
+            return following
+        return op
+    return decode
+
+
+def decode_stack_relation(operation):
+    def decode(args, following):
+        stack = data_stack
+        pop = stack.pop
+        push = stack.append
+
+        def op():
+            if len(stack) < 2:
+                Error.error_exit(fiftysix)
+            right = pop()
+            left = pop()
+            if type(left) is not type(right) or left is nil:
+                Error.error_exit(fiftythree)
+            push(operation(left, right))
+            return following
+        return op
+    return decode
+
+
+def decode_eqs(args, following):
+    stack = data_stack
+    pop = stack.pop
+    push = stack.append
+
+    def op():
+        if len(stack) < 2:
+            Error.error_exit(fiftysix)
+        right = pop()
+        push(values_equal(pop(), right))
+        return following
+    return op
+
+
+def decode_stack_logic(operation):
+    def decode(args, following):
+        stack = data_stack
+        pop = stack.pop
+        push = stack.append
+
+        def op():
+            if len(stack) < 2:
+                Error.error_exit(fiftysix)
+            right = pop()
+            left = pop()
+            if type(left) is not bool or type(right) is not bool:
+                Error.error_exit(fiftythree)
+            push(operation(left, right))
+            return following
+        return op
+    return decode
+
+
+def decode_nots(args, following):
+    stack = data_stack
+
+    def op():
+        if len(stack) == 0:
+            Error.error_exit(fiftysix)
+        value = stack[-1]
+        if type(value) is not bool:
+            Error.error_exit(fiftythree)
+        stack[-1] = not value
+        return following
+    return op
+
+
+def decode_int2chars(args, following):
+    stack = data_stack
+
+    def op():
+        if len(stack) == 0:
+            Error.error_exit(fiftysix)
+        value = stack[-1]
+        if type(value) is not int:
+            Error.error_exit(fiftythree)
+        try:
+            stack[-1] = chr(value)
+        except (ValueError, OverflowError):
+            Error.error_exit(fiftyeight)
+        return following
+    return op
+
+
+def decode_stri2ints(args, following):
+    stack = data_stack
+    pop = stack.pop
+    push = stack.append
+
+    def op():
+        if len(stack) < 2:
+            Error.error_exit(fiftysix)
+        position = pop()
+        text = pop()
+        if type(text) is not str or type(position) is not int:
+            Error.error_exit(fiftythree)
+        if position < 0 or position >= len(text):
+            Error.error_exit(fiftyeight)
+        push(ord(text[position]))
+        return following
+    return op
+
+
+def decode_stack_jump(args, following, when_equal):
+    target = args[0].target
+    stack = data_stack
+    pop = stack.pop
+
+    def op():
+        if len(stack) < 2:
+            Error.error_exit(fiftysix)
+        right = pop()
+        if values_equal(pop(), right) == when_equal:
+            return target
+        return following
+    return op
+
+
+def decode_jumpifeqs(args, following):
+    return decode_stack_jump(args, following, True)
+
+
+def decode_jumpifneqs(args, following):
+    return decode_stack_jump(args, following, False)
+
+
+threaded_opcodes = {
+    "CREATEFRAME": ((), decode_createframe),
+    "PUSHFRAME": ((), decode_pushframe),
+    "POPFRAME": ((), decode_popframe),
+    "RETURN": ((), decode_return),
+    "BREAK": ((), decode_break),
+    "DEFVAR": (("var",), decode_defvar),
+    "PUSHS": (("symb",), decode_pushs),
+    "POPS": (("var",), decode_pops),
+    "CALL": (("label",), decode_call),
+    "LABEL": (("label",), decode_label),
+    "JUMP": (("label",), decode_jump),
+    "EXIT": (("symb",), decode_exit),
+    "WRITE": (("symb",), decode_write),
+    "DPRINT": (("symb",), decode_dprint),
+    "MOVE": (("var", "symb"), decode_move),
+    "INT2CHAR": (("var", "symb"), decode_int2char),
+    "STRLEN": (("var", "symb"), decode_strlen),
+    "TYPE": (("var", "symb"), decode_type),
+    "NOT": (("var", "symb"), decode_not),
+    "READ": (("var", "type"), decode_read),
+    "ADD": (("var", "symb", "symb"), decode_arithmetic(operator.add)),
+    "SUB": (("var", "symb", "symb"), decode_arithmetic(operator.sub)),
+    "MUL": (("var", "symb", "symb"), decode_arithmetic(operator.mul)),
+    "IDIV": (("var", "symb", "symb"), decode_division(integer_division, int)),
+    "DIV": (("var", "symb", "symb"), decode_division(float_division, float)),
+    "INT2FLOAT": (("var", "symb"), decode_conversion(int_to_float)),
+    "FLOAT2INT": (("var", "symb"), decode_conversion(float_to_int)),
+    "LT": (("var", "symb", "symb"), decode_relation(operator.lt)),
+    "GT": (("var", "symb", "symb"), decode_relation(operator.gt)),
+    "EQ": (("var", "symb", "symb"), decode_eq),
+    "AND": (("var", "symb", "symb"), decode_logic(operator.and_)),
+    "OR": (("var", "symb", "symb"), decode_logic(operator.or_)),
+    "STRI2INT": (("var", "symb", "symb"), decode_stri2int),
+    "CONCAT": (("var", "symb", "symb"), decode_concat),
+    "GETCHAR": (("var", "symb", "symb"), decode_getchar),
+    "SETCHAR": (("var", "symb", "symb"), decode_setchar),
+    "JUMPIFEQ": (("label", "symb", "symb"), decode_jumpifeq),
+    "JUMPIFNEQ": (("label", "symb", "symb"), decode_jumpifneq),
+    "CLEARS": ((), decode_clears),
+    "ADDS": ((), decode_stack_arithmetic(operator.add)),
+    "SUBS": ((), decode_stack_arithmetic(operator.sub)),
+    "MULS": ((), decode_stack_arithmetic(operator.mul)),
+    "IDIVS": ((), decode_stack_division(integer_division, int)),
+    "DIVS": ((), decode_stack_division(float_division, float)),
+    "INT2FLOATS": ((), decode_stack_conversion(int_to_float)),
+    "FLOAT2INTS": ((), decode_stack_conversion(float_to_int)),
+    "LTS": ((), decode_stack_relation(operator.lt)),
+    "GTS": ((), decode_stack_relation(operator.gt)),
+    "EQS": ((), decode_eqs),
+    "ANDS": ((), decode_stack_logic(operator.and_)),
+    "ORS": ((), decode_stack_logic(operator.or_)),
+    "NOTS": ((), decode_nots),
+    "INT2CHARS": ((), decode_int2chars),
+    "STRI2INTS": ((), decode_stri2ints),
+    "JUMPIFEQS": (("label",), decode_jumpifeqs),
+    "JUMPIFNEQS": (("label",), decode_jumpifneqs),
+}
+
+
+def decode_program(instruction_list):
+    global global_frame, local_template
+    global_frame = []
+    local_template = []
+    global_names.clear()
+    local_names.clear()
+    text_globals.clear()
+    text_locals.clear()
+    frame_pool.clear()
+    # only destinations of CONCAT and SETCHAR can hold Text, readers of other
+    # variables do not need to look for it
+    writers = instruction_list
+    if isinstance(instruction_list, CompactProgram):
+        writers = instruction_list.with_opcodes("CONCAT", "SETCHAR")
+    for instruction in writers:
+        if instruction.opcode in ("CONCAT", "SETCHAR") and instruction.arg_list \
+                and instruction.arg_list[0].val_type == "var":
+            frame, slot = resolve_variable(instruction.arg_list[0])
+            (text_globals if frame == "GF" else text_locals).add(slot)
+    decoded = []
+    for index, instruction in enumerate(instruction_list):
+        if instruction.opcode not in threaded_opcodes:
+            Error.error_exit(thirtytwo)
+        signature, decoder = threaded_opcodes[instruction.opcode]
+        check_operands(instruction, signature)
+        decoded.append(decoder(instruction.arg_list, index + 1))
+    global_frame.extend([None] * len(global_names))
+    local_template.extend([None] * len(local_names))
+    return decoded
+
+
+# compact program, the instruction list as parallel arrays, an opcode is a code into
+# opcode_names, an operand is a code into kind_names with an index into names (variables,
+# labels, types) or into the literal table, passes still get Instruction objects, they
+# are built from the arrays only while a pass looks at them
+name_kinds = ("var", "label", "type")
+literal_kinds = ("int", "float", "bool", "string", "nil")
+
+
+class CompactProgram:
+    __slots__ = ("opcode_names", "opcodes", "orders", "first_operand", "kind_names", "kinds", "operands", "names",
+                 "literal_texts", "literals", "labels")
+
+    def __init__(self):
+        self.opcode_names = list(threaded_opcodes)
+        self.opcodes = array.array("B")
+        self.orders = array.array("q")
+        # operands of instruction i are first_operand[i] up to first_operand[i + 1]
+        self.first_operand = array.array("I", [0])
+        self.kind_names = list(name_kinds + literal_kinds)
+        self.kinds = array.array("B")
+        self.operands = array.array("I")
+        self.names = []
+        self.literal_texts = []
+        self.literals = []
+        self.labels = {}
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.instruction(position) for position in range(*index.indices(len(self.opcodes)))]
+        if index < 0:
+            index += len(self.opcodes)
+        return self.instruction(index)
+
+    def __iter__(self):
+        for index in range(len(self.opcodes)):
+            yield self.instruction(index)
+
+    # both skip the checks of the constructors, the program was validated when encoded
+    def argument(self, position, number):
+        argument = Argument.__new__(Argument)
+        kind = argument.val_type = self.kind_names[self.kinds[position]]
+        index = self.operands[position]
+        argument.order = number
+        argument.target = None
+        if kind in literal_kinds:
+            argument.value = self.literal_texts[index]
+            argument.literal = self.literals[index]
+        else:
+            argument.value = self.names[index]
+            argument.literal = None
+            if kind == "label":
+                argument.target = self.labels.get(argument.value)
+        return argument
+
+    # instructions with one of the opcodes, found without building the others
+    def with_opcodes(self, *opcodes):
+        codes = {code for code, name in enumerate(self.opcode_names) if name in opcodes}
+        for index, code in enumerate(self.opcodes):
+            if code in codes:
+                yield self.instruction(index)
+
+    def instruction(self, index):
+        instruction = Instruction.__new__(Instruction)
+        instruction.opcode = self.opcode_names[self.opcodes[index]]
+        instruction.order = self.orders[index]
+        first = self.first_operand[index]
+        instruction.arg_list = [self.argument(position, position - first + 1)
+                                for position in range(first, self.first_operand[index + 1])]
+        return instruction
+
+
+# names and literals are interned while instructions are added, codes that do not fit
+# a byte move their array to two bytes
+class CompactBuilder:
+    def __init__(self):
+        self.program = CompactProgram()
+        self.opcode_codes = {name: code for code, name in enumerate(self.program.opcode_names)}
+        self.kind_codes = {name: code for code, name in enumerate(self.program.kind_names)}
+        self.name_index = {}
+        self.literal_index = {}
+        self.literal_kinds = []
+
+    def code(self, codes, names, name, attribute):
+        code = codes[name] = len(names)
+        names.append(name)
+        if code == 256:
+            setattr(self.program, attribute, array.array("H", getattr(self.program, attribute)))
+        return code
+
+    # literal is the converted value or None when the program is converted later
+    def operand(self, argument):
+        program = self.program
+        if argument.val_type in literal_kinds:
+            key = (argument.val_type, argument.value)
+            index = self.literal_index.get(key)
+            if index is None:
+                index = self.literal_index[key] = len(program.literals)
+                program.literal_texts.append(argument.value)
+                program.literals.append(argument.literal)
+                self.literal_kinds.append(argument.val_type)
+            return index
+        index = self.name_index.get(argument.value)
+        if index is None:
+            index = self.name_index[argument.value] = len(program.names)
+            program.names.append(argument.value)
+        return index
+
+    def add(self, instruction):
+        program = self.program
+        code = self.opcode_codes.get(instruction.opcode)
+        if code is None:
+            code = self.code(self.opcode_codes, program.opcode_names, instruction.opcode, "opcodes")
+        program.opcodes.append(code)
+        program.orders.append(instruction.order or 0)
+        for argument in instruction.arg_list:
+            code = self.kind_codes.get(argument.val_type)
+            if code is None:
+                code = self.code(self.kind_codes, program.kind_names, argument.val_type, "kinds")
+            program.kinds.append(code)
+            index = self.name_index.get(argument.value) if code < len(name_kinds) else None
+            program.operands.append(self.operand(argument) if index is None else index)
+        program.first_operand.append(len(program.kinds))
+
+    # instructions as they came in the document go to the order of their order attribute
+    def sort(self):
+        program = self.program
+        orders = program.orders
+        if any(first >= second for first, second in zip(orders, orders[1:])):
+            permutation = sorted(range(len(orders)), key=orders.__getitem__)
+            first_operand = program.first_operand
+            kinds = array.array(program.kinds.typecode)
+            operands = array.array("I")
+            starts = array.array("I", [0])
+            for index in permutation:
+                kinds.extend(program.kinds[first_operand[index]:first_operand[index + 1]])
+                operands.extend(program.operands[first_operand[index]:first_operand[index + 1]])
+                starts.append(len(kinds))
+            program.opcodes = array.array(program.opcodes.typecode, [program.opcodes[index] for index in permutation])
+            program.orders = array.array("q", [orders[index] for index in permutation])
+            program.first_operand, program.kinds, program.operands = starts, kinds, operands
+            orders = program.orders
+        if any(first == second for first, second in zip(orders, orders[1:])):
+            Error.error_exit(thirtytwo)
+
+    # same conversion and errors as build_literal_table
+    def convert_literals(self):
+        program = self.program
+        for index, (kind, text) in enumerate(zip(self.literal_kinds, program.literal_texts)):
+            literal = convert_literal(Argument(kind, text))
+            program.literals[index] = literal
+            if kind == "string":
+                program.literal_texts[index] = literal
+
+    # same checks and errors as check_labels
+    def link_labels(self):
+        program = self.program
+        label_kind = self.kind_codes["label"]
+        label_code = self.opcode_codes["LABEL"]
+        labels_ordered.clear()
+        for index, opcode in enumerate(program.opcodes):
+            if opcode != label_code:
+                continue
+            first = program.first_operand[index]
+            if program.first_operand[index + 1] - first != 1 or program.kinds[first] != label_kind:
+                Error.error_exit(thirtytwo)
+            label_name = program.names[program.operands[first]]
+            if label_name in labels_ordered:
+                Error.error_exit(fiftytwo)
+            labels_ordered[label_name] = index
+        for kind, operand in zip(program.kinds, program.operands):
+            if kind == label_kind and program.names[operand] not in labels_ordered:
+                Error.error_exit(fiftytwo)
+        program.labels = dict(labels_ordered)
+
+
+# encodes an already validated instruction list
+def compact_program(instruction_list):
+    builder = CompactBuilder()
+    for index, instruction in enumerate(instruction_list):
+        builder.add(instruction)
+        if instruction.opcode == "LABEL" and instruction.arg_list:
+            builder.program.labels[instruction.arg_list[0].value] = index
+    return builder.program
+
+
+# loads straight into the arrays, an Instruction lives only until it is encoded, errors
+# come in the same order as from load_stream
+def load_compact_stream(source):
+    builder = CompactBuilder()
+    for instruction in parse_instructions(source):
+        builder.add(instruction)
+    builder.sort()
+    builder.convert_literals()
+    builder.link_labels()
+    return builder.program
+
+
+# bytes of everything the program holds, objects shared between instructions are counted
+# once, the report of --program-report
+def program_bytes(program):
+    if isinstance(program, CompactProgram):
+        pending = [program, program.opcode_names, program.opcodes, program.orders, program.first_operand,
+                   program.kind_names, program.kinds, program.operands, program.names, program.literal_texts,
+                   program.literals, program.labels]
+        pending += program.opcode_names + program.kind_names + program.names + program.literal_texts
+        pending += program.literals + list(program.labels)
     else:
-        input_file_split = [line.strip for line in sys.stdin]
+        pending = [program]
+        for instruction in program:
+            pending += (instruction, instruction.opcode, instruction.order, instruction.arg_list)
+            for argument in instruction.arg_list:
+                pending += (argument, argument.val_type, argument.value, argument.order, argument.literal,
+                            argument.target)
+    seen = set()
+    total = 0
+    for item in pending:
+        if id(item) not in seen:
+            seen.add(id(item))
+            total += sys.getsizeof(item)
+    return total
+
+
+# static pass over the validated instruction list, constants known in GF variables are
+# propagated along the control flow graph, instructions with known result become MOVE
+# and blocks that cannot be reached are dropped, folders return None when the
+# instruction would fail at run time so the error still happens
+def fold_arithmetic(operation):
+    def fold(left, right):
+        if type(left) is not type(right) or type(left) not in (int, float):
+            return None
+        return operation(left, right)
+    return fold
+
+
+def fold_division(operation, kind):
+    def fold(left, right):
+        if type(left) is not kind or type(right) is not kind or right == 0:
+            return None
+        return operation(left, right)
+    return fold
+
+
+def fold_int2float(value):
+    if type(value) is not int:
+        return None
+    try:
+        return float(value)
+    except OverflowError:
+        return None
 
-    # fix checking of xml fails
+
+def fold_float2int(value):
+    if type(value) is not float:
+        return None
     try:
-        string_one = "".join(source_file_split)
-        root = ET.fromstring(string_one)
-    except(Exception,):
-        Error.error_exit(thirtyone)
+        return int(value)
+    except (OverflowError, ValueError):
+        return None
 
-    # check if xml is correct
-    check_xml_start(root)
 
-    instruction_list = load_xml_to_list(root)
-    for instruction in instruction_list:
+def fold_relation(operation):
+    def fold(left, right):
+        if type(left) is not type(right) or left is nil:
+            return None
+        return operation(left, right)
+    return fold
+
+
+def fold_eq(left, right):
+    if left is nil or right is nil:
+        return left is right
+    if type(left) is not type(right):
+        return None
+    return left == right
+
+
+def fold_logic(operation):
+    def fold(left, right):
+        if type(left) is not bool or type(right) is not bool:
+            return None
+        return operation(left, right)
+    return fold
+
+
+def fold_not(value):
+    return not value if type(value) is bool else None
+
+
+def fold_int2char(value):
+    if type(value) is not int or value not in range(0x110000):
+        return None
+    return chr(value)
+
+
+def fold_stri2int(text, position):
+    if type(text) is not str or type(position) is not int or position not in range(len(text)):
+        return None
+    return ord(text[position])
+
+
+def fold_concat(left, right):
+    if type(left) is not str or type(right) is not str:
+        return None
+    return left + right
+
+
+def fold_strlen(text):
+    return len(text) if type(text) is str else None
+
+
+def fold_getchar(text, position):
+    if type(text) is not str or type(position) is not int or position not in range(len(text)):
+        return None
+    return text[position]
+
+
+def fold_setchar(text, position, replacement):
+    if type(text) is not str or type(position) is not int or type(replacement) is not str:
+        return None
+    if position not in range(len(text)) or replacement == "":
+        return None
+    return text[:position] + replacement[0] + text[position + 1:]
+
+
+def fold_type(value):
+    return value_types[type(value)]
+
+
+# opcode: folder and whether the destination is read as the first operand
+folders = {
+    "MOVE": (lambda value: value, False),
+    "ADD": (fold_arithmetic(operator.add), False),
+    "SUB": (fold_arithmetic(operator.sub), False),
+    "MUL": (fold_arithmetic(operator.mul), False),
+    "IDIV": (fold_division(operator.floordiv, int), False),
+    "DIV": (fold_division(operator.truediv, float), False),
+    "INT2FLOAT": (fold_int2float, False),
+    "FLOAT2INT": (fold_float2int, False),
+    "LT": (fold_relation(operator.lt), False),
+    "GT": (fold_relation(operator.gt), False),
+    "EQ": (fold_eq, False),
+    "AND": (fold_logic(operator.and_), False),
+    "OR": (fold_logic(operator.or_), False),
+    "NOT": (fold_not, False),
+    "INT2CHAR": (fold_int2char, False),
+    "STRI2INT": (fold_stri2int, False),
+    "CONCAT": (fold_concat, False),
+    "STRLEN": (fold_strlen, False),
+    "GETCHAR": (fold_getchar, False),
+    "SETCHAR": (fold_setchar, True),
+    "TYPE": (fold_type, False),
+}
+control_opcodes = ("JUMP", "JUMPIFEQ", "JUMPIFNEQ", "JUMPIFEQS", "JUMPIFNEQS", "CALL", "RETURN", "EXIT")
+
+
+def constant_argument(value):
+    match value_types[type(value)]:
+        case "string":
+            text = value
+        case "bool":
+            text = "true" if value else "false"
+        case "nil":
+            text = "nil"
+        case "float":
+            text = value.hex()
+        case _:
+            text = str(value)
+    argument = Argument(value_types[type(value)], text)
+    argument.literal = value
+    return argument
+
+
+def known_value(argument, known):
+    if argument.val_type != "var":
+        return argument.literal
+    return known.get(argument.value)
+
+
+# symbol operands that read a GF variable with known value get the constant instead
+def propagate_constants(instruction, known):
+    signature = threaded_opcodes[instruction.opcode][0]
+    arguments = instruction.arg_list
+    for position, kind in enumerate(signature):
+        argument = arguments[position]
+        if kind == "symb" and argument.val_type == "var" and argument.value in known:
+            if arguments is instruction.arg_list:
+                arguments = list(arguments)
+            arguments[position] = constant_argument(known[argument.value])
+    return arguments
+
+
+def global_destination(instruction):
+    signature = threaded_opcodes[instruction.opcode][0]
+    if signature and signature[0] == "var" and instruction.arg_list[0].value.startswith("GF@"):
+        return instruction.arg_list[0].value
+    return None
+
+
+# floats by their bits so that -0.0 and 0.0 stay apart
+def same_constant(first, second):
+    if type(first) is not type(second):
+        return False
+    if type(first) is float:
+        return first.hex() == second.hex()
+    return first == second
+
+
+# effect of one instruction on known constants, returns its result if it is known
+def fold_step(instruction, known):
+    destination = global_destination(instruction)
+    result = None
+    if instruction.opcode in folders:
+        fold, reads_destination = folders[instruction.opcode]
+        sources = instruction.arg_list if reads_destination else instruction.arg_list[1:]
+        values = [known_value(argument, known) for argument in sources]
+        if None not in values:
+            result = fold(*values)
+    if destination:
+        if result is None:
+            known.pop(destination, None)
+        else:
+            known[destination] = result
+    return result
+
+
+# True or False when JUMPIFEQ/JUMPIFNEQ is always or never taken
+def jump_decision(instruction, known):
+    if instruction.opcode not in ("JUMPIFEQ", "JUMPIFNEQ"):
+        return None
+    first = known_value(instruction.arg_list[1], known)
+    second = known_value(instruction.arg_list[2], known)
+    if first is None or second is None:
+        return None
+    equal = fold_eq(first, second)
+    if equal is None:
+        return None
+    return equal == (instruction.opcode == "JUMPIFEQ")
+
+
+def fold_program(instruction_list):
+    end = len(instruction_list)
+    opcodes = [instruction.opcode for instruction in instruction_list]
+    return_sites = [index + 1 for index in range(end) if opcodes[index] == "CALL" and index + 1 < end]
+    starts = {0}
+    for index, opcode in enumerate(opcodes):
+        if opcode == "LABEL":
+            starts.add(index)
+        elif opcode in control_opcodes and index + 1 < end:
+            starts.add(index + 1)
+    starts = sorted(start for start in starts if start < end)
+    blocks = []
+    block_of = {}
+    for number, start in enumerate(starts):
+        block_of[start] = number
+        blocks.append((start, starts[number + 1] if number + 1 < len(starts) else end))
+
+    # dropping a jump that is never taken would change the counts BREAK reports, a kept
+    # jump still needs the block it names
+    keep_jumps = "BREAK" in opcodes
+
+    # RETURN may go back after any CALL, CALL itself only enters the callee
+    def successors(stop, known):
+        last = instruction_list[stop - 1]
+        following = [stop] if stop < end else []
+        match last.opcode:
+            case "JUMP" | "CALL":
+                return [last.arg_list[0].target]
+            case "JUMPIFEQ" | "JUMPIFNEQ" | "JUMPIFEQS" | "JUMPIFNEQS":
+                taken = jump_decision(last, known)
+                if taken is None or taken is False and keep_jumps:
+                    return [last.arg_list[0].target] + following
+                return [last.arg_list[0].target] if taken else following
+            case "RETURN":
+                return return_sites
+            case "EXIT":
+                return []
+        return following
+
+    # constants known at the start of every reached block, None until it is reached
+    entry = [None] * len(blocks)
+    pending = []
+    if blocks:
+        entry[0] = {}
+        pending.append(0)
+    while pending:
+        number = pending.pop()
+        start, stop = blocks[number]
+        known = dict(entry[number])
+        for index in range(start, stop):
+            fold_step(instruction_list[index], known)
+        for target in successors(stop, known):
+            successor = block_of[target]
+            if entry[successor] is None:
+                entry[successor] = dict(known)
+            else:
+                merged = {name: value for name, value in entry[successor].items()
+                          if name in known and same_constant(known[name], value)}
+                if len(merged) == len(entry[successor]):
+                    continue
+                entry[successor] = merged
+            pending.append(successor)
+
+    optimized = []
+    folded = 0
+    for number, (start, stop) in enumerate(blocks):
+        if entry[number] is None:
+            continue
+        known = dict(entry[number])
+        for instruction in instruction_list[start:stop]:
+            taken = jump_decision(instruction, known)
+            if taken:
+                optimized.append(Instruction("JUMP", instruction.arg_list[:1], instruction.order))
+                folded += 1
+                continue
+            if taken is False and not keep_jumps:
+                folded += 1
+                continue
+            arguments = propagate_constants(instruction, known)
+            result = fold_step(instruction, known)
+            if result is not None and (instruction.opcode != "MOVE" or arguments is not instruction.arg_list):
+                if instruction.opcode != "MOVE":
+                    folded += 1
+                instruction = Instruction("MOVE", [instruction.arg_list[0], constant_argument(result)],
+                                          instruction.order)
+            elif arguments is not instruction.arg_list:
+                instruction = Instruction(instruction.opcode, arguments, instruction.order)
+            optimized.append(instruction)
+    check_labels(optimized)
+    return optimized, len(instruction_list) - len(optimized), folded
+
+
+# peephole pass, a superinstruction stands in for a run of instructions starting at its
+# index, weights say how many instructions each handler executes so BREAK counts stay the same
+def fuse_counting_jump(arithmetic, jump, following):
+    operation = operator.add if arithmetic.opcode == "ADD" else operator.sub
+    store = make_store(arithmetic.arg_list[0])
+    first = make_symbol_reader(arithmetic.arg_list[1])
+    second = make_symbol_reader(arithmetic.arg_list[2])
+    target = jump.arg_list[0].target
+    when_equal = jump.opcode == "JUMPIFEQ"
+    result = arithmetic.arg_list[0].value
+    compared = jump.arg_list[1:]
+    if compared[1].val_type == "var" and compared[1].value == result:
+        compared = compared[::-1]
+    compare_first = make_symbol_reader(jump.arg_list[1])
+    compare_second = make_symbol_reader(jump.arg_list[2])
+
+    def general():
+        left = first()
+        right = second()
+        if type(left) is not int or type(right) is not int:
+            if type(left) is not float or type(right) is not float:
+                Error.error_exit(fiftythree)
+        store(operation(left, right))
+        if values_equal(compare_first(), compare_second()) == when_equal:
+            return target
+        return following
+
+    # usual loop end, the fresh int result is compared with an int constant
+    if compared[0].val_type == "var" and compared[0].value == result and compared[1].val_type == "int":
+        limit = compared[1].literal
+
+        def op():
+            left = first()
+            right = second()
+            if type(left) is not int or type(right) is not int:
+                return general()
+            value = operation(left, right)
+            store(value)
+            if (value == limit) == when_equal:
+                return target
+            return following
+        return op
+    return general
+
+
+def fuse_defvar_move(defvar, move, following):
+    define = decode_defvar(defvar.arg_list, following)
+    store = make_store(move.arg_list[0])
+    source = make_symbol_reader(move.arg_list[1])
+
+    def op():
+        define()
+        store(source())
+        return following
+    return op
+
+
+# value goes straight to the variable, stack ends up the same
+def fuse_pushs_pops(pushs, pops, following):
+    source = make_symbol_reader(pushs.arg_list[0])
+    store = make_store(pops.arg_list[0])
+
+    def op():
+        store(source())
+        return following
+    return op
+
+
+superinstructions = {
+    ("ADD", "JUMPIFEQ"): fuse_counting_jump,
+    ("ADD", "JUMPIFNEQ"): fuse_counting_jump,
+    ("SUB", "JUMPIFEQ"): fuse_counting_jump,
+    ("SUB", "JUMPIFNEQ"): fuse_counting_jump,
+    ("DEFVAR", "MOVE"): fuse_defvar_move,
+    ("PUSHS", "POPS"): fuse_pushs_pops,
+}
+
+
+def threaded_jump(target):
+    def op():
+        return target
+    return op
+
+
+def optimize_program(instruction_list, handlers, checked=()):
+    opcodes = [instruction.opcode for instruction in instruction_list]
+    end = len(handlers)
+    optimized = handlers.copy()
+    weights = [1] * end
+
+    # only the first instruction of a pair is replaced, the second keeps its own
+    # handler for anything that returns or falls into it, a pair is built from the
+    # instructions so one starting with a budget check in checked is left alone
+    for index in range(end - 1):
+        fuse = superinstructions.get((opcodes[index], opcodes[index + 1]))
+        if fuse and index not in checked:
+            optimized[index] = fuse(instruction_list[index], instruction_list[index + 1], index + 2)
+            weights[index] = 2
+
+    # JUMP to labels followed by another JUMP goes to the last target at once
+    for index in range(end):
+        if opcodes[index] != "JUMP":
+            continue
+        target = instruction_list[index].arg_list[0].target
+        skipped = 0
+        visited = {index}
+        while True:
+            position = target
+            while position < end and opcodes[position] == "LABEL":
+                position += 1
+            if position >= end or opcodes[position] != "JUMP" or position in visited:
+                break
+            visited.add(position)
+            skipped += position - target + 1
+            target = instruction_list[position].arg_list[0].target
+        if skipped:
+            optimized[index] = threaded_jump(target)
+            weights[index] += skipped
+
+    # LABEL does nothing, its index runs whatever follows it
+    for index in range(end - 2, -1, -1):
+        if opcodes[index] == "LABEL":
+            optimized[index] = optimized[index + 1]
+            weights[index] = weights[index + 1] + 1
+    return optimized, weights
+
+
+# tier 2, a LABEL reached often enough gets the instructions after it translated to one
+# python function, jumps back to the label become a while loop, operands are read from
+# the frame lists directly and guarded, when a guard fails the function returns the
+# index of that instruction and the handlers run it with all their checks
+tier2_threshold = 1000
+tier2_limit = 200
+# compiled loops return to the dispatcher after this many instructions, with an
+# instruction budget the dispatcher keeps what is left of it in tier2_remaining and a
+# loop stops before the next pass through it could go over
+tier2_slice = 1 << 16
+tier2_executed = [0]
+tier2_remaining = [None]
+tier2_cache = {}
+tier2_opcodes = ("LABEL", "MOVE", "ADD", "SUB", "MUL", "IDIV", "DIV", "LT", "GT", "EQ", "AND", "OR", "NOT",
+                 "INT2CHAR", "STRI2INT", "INT2FLOAT", "FLOAT2INT", "STRLEN", "GETCHAR", "TYPE", "READ", "WRITE",
+                 "PUSHS", "POPS", "JUMP", "JUMPIFEQ", "JUMPIFNEQ", "ADDS", "SUBS", "MULS", "IDIVS", "DIVS",
+                 "JUMPIFEQS", "JUMPIFNEQS")
+tier2_binary = {"ADD": "+", "SUB": "-", "MUL": "*", "IDIV": "//", "DIV": "/", "LT": "<", "GT": ">", "AND": "and",
+                "OR": "or", "ADDS": "+", "SUBS": "-", "MULS": "*", "IDIVS": "//", "DIVS": "/"}
+
+
+class RegionCompiler:
+    def __init__(self, instruction_list, start, names, max_stack=None):
+        self.instruction_list = instruction_list
+        self.start = start
+        self.max_stack = max_stack
+        self.global_names, self.local_names, self.text_globals, self.text_locals, self.global_frame = names
+        self.lines = []
+        self.frames_used = set()
+        self.destinations = set()
+        self.temporaries = 0
+        # one pass through the loop body is straight code, so a value stored or read
+        # once stays in a local with its type (None when not known) until it changes
+        self.values = {}
+        self.kinds = {}
+
+    def emit(self, line, depth=0):
+        self.lines.append("            " + "    " * depth + line)
+
+    # leave the function before instruction at index, everything before it was executed
+    def leave(self, index, depth=0):
+        self.emit("counter[0] += count + %d" % (index - self.start), depth)
+        self.emit("return %d" % index, depth)
+
+    def guard(self, condition, index):
+        self.emit("if " + condition + ":")
+        self.leave(index, 1)
+
+    def temporary(self, kind=None):
+        self.temporaries += 1
+        name = "v%d" % self.temporaries
+        self.kinds[name] = kind
+        return name
+
+    # slots of the program the region belongs to, the module tables may hold another
+    # program decoded since then
+    def resolve(self, argument):
+        frame, _, name = argument.value.partition("@")
+        return frame, (self.global_names if frame == "GF" else self.local_names)[name]
+
+    def slot(self, argument):
+        frame, slot = self.resolve(argument)
+        self.frames_used.add(frame)
+        texts = self.text_globals if frame == "GF" else self.text_locals
+        return {"GF": "g", "LF": "lf", "TF": "tf"}[frame] + "[%d]" % slot, slot in texts
+
+    # expression with the operand value, None when the operand can never pass
+    def read(self, argument, index, wanted=None):
+        if argument.val_type == "var" and wanted is str:
+            location, text_slot = self.slot(argument)
+            if text_slot and location not in self.values:
+                return self.read_text(location, index)
+        if argument.val_type != "var":
+            value = argument.literal
+            if wanted is not None and type(value) is not wanted:
+                return None
+            if value is nil:
+                name = "nil"
+            elif type(value) is float:
+                # inf and nan have no literal
+                name = "float.fromhex(%r)" % value.hex()
+            else:
+                name = repr(value)
+            self.kinds[name] = type(value)
+            return name
+        location, text_slot = self.slot(argument)
+        if location in self.values:
+            name = self.values[location]
+        else:
+            name = self.temporary()
+            self.emit(name + " = " + location)
+            if text_slot:
+                self.emit("if type(%s) is Text:" % name)
+                self.emit("%s = %s.text()" % (name, name), 1)
+            self.values[location] = name
+            if wanted is not None:
+                self.guard("type(%s) is not %s" % (name, wanted.__name__), index)
+                self.kinds[name] = wanted
+                return name
+            self.guard("%s is None or %s is uninitialized" % (name, name), index)
+        if wanted is not None and self.kinds[name] is not wanted:
+            if self.kinds[name] is not None:
+                return None
+            self.guard("type(%s) is not %s" % (name, wanted.__name__), index)
+            self.kinds[name] = wanted
+        return name
+
+    # indexing and len work on the Text array the same as on str, flat string
+    # would be rebuilt after every SETCHAR
+    def read_text(self, location, index):
+        name = self.temporary(str)
+        self.emit(name + " = " + location)
+        self.emit("if type(%s) is Text:" % name)
+        self.emit("%s = %s.chars" % (name, name), 1)
+        self.emit("elif type(%s) is not str:" % name)
+        self.leave(index, 1)
+        return name
+
+    # ADD, SUB and MUL are compiled for floats when a float operand is known or
+    # a variable holds one right now, otherwise for ints
+    def numeric_kind(self, arguments):
+        for argument in arguments:
+            if argument.val_type == "float":
+                return float
+            if argument.val_type != "var":
+                continue
+            location, _ = self.slot(argument)
+            if location in self.values:
+                if self.kinds[self.values[location]] is float:
+                    return float
+                continue
+            frame, slot = self.resolve(argument)
+            match frame:
+                case "GF":
+                    current = self.global_frame
+                case "LF":
+                    current = local_frame[-1] if local_frame else None
+                case _:
+                    current = temp_frame
+            if current is not None and type(current[slot]) is float:
+                return float
+        return int
+
+    def store(self, argument, expression, kind=None):
+        location, _ = self.slot(argument)
+        self.destinations.add(location)
+        if expression not in self.kinds or expression[0] != "v":
+            name = self.temporary(kind)
+            self.emit(name + " = " + expression)
+            expression = name
+        self.emit(location + " = " + expression)
+        self.values[location] = expression
+
+    # nil compares with anything, other values only with the same type,
+    # None when the comparison always fails
+    def equality(self, first, second, index):
+        kinds = (self.kinds[first], self.kinds[second])
+        if Nil in kinds:
+            if None not in kinds:
+                return "True" if kinds[0] is kinds[1] else "False"
+            # the other operand is a variable, "is" with a literal is a SyntaxWarning
+            return "(%s is nil)" % (first if kinds[0] is None else second)
+        if None not in kinds:
+            if kinds[0] is not kinds[1]:
+                return None
+            return "(%s == %s)" % (first, second)
+        name = self.temporary(bool)
+        if kinds == (None, None):
+            self.emit("if %s is nil or %s is nil:" % (first, second))
+            self.emit("%s = %s is %s" % (name, first, second), 1)
+            self.emit("elif type(%s) is type(%s):" % (first, second))
+        else:
+            unknown, kind = (first, kinds[1]) if kinds[0] is None else (second, kinds[0])
+            self.emit("if %s is nil:" % unknown)
+            self.emit(name + " = False", 1)
+            self.emit("elif type(%s) is %s:" % (unknown, kind.__name__))
+        self.emit("%s = %s == %s" % (name, first, second), 1)
+        self.emit("else:")
+        self.leave(index, 1)
+        return name
+
+    def jump(self, target, index, condition=None):
+        depth = 0
+        if condition is not None:
+            self.emit("if " + condition + ":")
+            depth = 1
+        if target == self.start:
+            self.emit("count += %d" % (index - self.start + 1), depth)
+            self.emit("if count < size:", depth)
+            self.emit("    continue", depth)
+            self.emit("counter[0] += count", depth)
+            self.emit("return %d" % self.start, depth)
+        else:
+            self.emit("counter[0] += count + %d" % (index - self.start + 1), depth)
+            self.emit("return %d" % target, depth)
+
+    # emits one instruction, False when it cannot be compiled
+    def instruction(self, instruction, index):
+        args = instruction.arg_list
+        opcode = instruction.opcode
+        match opcode:
+            case "LABEL":
+                return True
+            case "MOVE":
+                value = self.read(args[1], index)
+                self.store(args[0], value, self.kinds[value])
+            case "ADD" | "SUB" | "MUL" | "IDIV" | "DIV":
+                match opcode:
+                    case "IDIV":
+                        kind = int
+                    case "DIV":
+                        kind = float
+                    case _:
+                        kind = self.numeric_kind(args[1:])
+                first = self.read(args[1], index, kind)
+                second = self.read(args[2], index, kind)
+                if first is None or second is None:
+                    return False
+                if opcode in ("IDIV", "DIV"):
+                    if second[0] != "v" and args[2].literal == 0:
+                        return False
+                    if second[0] == "v":
+                        self.guard(second + " == 0", index)
+                self.store(args[0], "%s %s %s" % (first, tier2_binary[opcode], second), kind)
+            case "LT" | "GT":
+                first = self.read(args[1], index)
+                second = self.read(args[2], index)
+                kinds = (self.kinds[first], self.kinds[second])
+                # "is" only on variables, a literal has its type known already
+                if kinds == (None, None):
+                    self.guard("type(%s) is not type(%s) or %s is nil" % (first, second, first), index)
+                elif None in kinds:
+                    unknown, kind = (first, kinds[1]) if kinds[0] is None else (second, kinds[0])
+                    if kind is Nil:
+                        return False
+                    self.guard("type(%s) is not %s" % (unknown, kind.__name__), index)
+                    self.kinds[unknown] = kind
+                elif kinds[0] is not kinds[1] or kinds[0] is Nil:
+                    return False
+                self.store(args[0], "%s %s %s" % (first, tier2_binary[opcode], second), bool)
+            case "EQ":
+                equal = self.equality(self.read(args[1], index), self.read(args[2], index), index)
+                if equal is None:
+                    return False
+                self.store(args[0], equal, bool)
+            case "AND" | "OR":
+                first = self.read(args[1], index, bool)
+                second = self.read(args[2], index, bool)
+                if first is None or second is None:
+                    return False
+                self.store(args[0], "(%s %s %s)" % (first, tier2_binary[opcode], second), bool)
+            case "NOT":
+                value = self.read(args[1], index, bool)
+                if value is None:
+                    return False
+                self.store(args[0], "not " + value, bool)
+            case "INT2CHAR":
+                value = self.read(args[1], index, int)
+                if value is None:
+                    return False
+                self.guard("not 0 <= %s <= 0x10FFFF" % value, index)
+                self.store(args[0], "chr(%s)" % value, str)
+            case "STRI2INT" | "GETCHAR":
+                text = self.read(args[1], index, str)
+                position = self.read(args[2], index, int)
+                if text is None or position is None:
+                    return False
+                self.guard("not 0 <= %s < len(%s)" % (position, text), index)
+                if opcode == "STRI2INT":
+                    self.store(args[0], "ord(%s[%s])" % (text, position), int)
+                else:
+                    self.store(args[0], "%s[%s]" % (text, position), str)
+            case "INT2FLOAT" | "FLOAT2INT":
+                value = self.read(args[1], index, int if opcode == "INT2FLOAT" else float)
+                if value is None:
+                    return False
+                name = self.temporary(float if opcode == "INT2FLOAT" else int)
+                self.emit("try:")
+                self.emit("%s = %s(%s)" % (name, "float" if opcode == "INT2FLOAT" else "int", value), 1)
+                self.emit("except (OverflowError, ValueError):")
+                self.leave(index, 1)
+                self.store(args[0], name, self.kinds[name])
+            case "STRLEN":
+                text = self.read(args[1], index, str)
+                if text is None:
+                    return False
+                self.store(args[0], "len(%s)" % text, int)
+            case "TYPE":
+                if args[1].val_type != "var":
+                    self.store(args[0], repr(value_types[type(args[1].literal)]), str)
+                else:
+                    location, _ = self.slot(args[1])
+                    name = self.values.get(location)
+                    if name is None:
+                        name = self.temporary()
+                        self.emit(name + " = " + location)
+                        self.guard(name + " is None", index)
+                    self.store(args[0], '"" if %s is uninitialized else value_types[type(%s)]' % (name, name), str)
+            case "READ":
+                name = self.temporary()
+                self.emit(name + " = input_reader.read_line()")
+                self.emit("if %s is None:" % name)
+                self.emit(name + " = nil", 1)
+                match args[1].value:
+                    case "int":
+                        self.emit("else:")
+                        self.emit("try:", 1)
+                        self.emit("%s = int(%s)" % (name, name), 2)
+                        self.emit("except ValueError:", 1)
+                        self.emit(name + " = nil", 2)
+                    case "float":
+                        self.emit("else:")
+                        self.emit("%s = float_or_nil(%s)" % (name, name), 1)
+                    case "bool":
+                        self.emit("else:")
+                        self.emit('%s = %s.upper() == "TRUE"' % (name, name), 1)
+                self.store(args[0], name)
+            case "WRITE":
+                self.emit("write(write_text(%s))" % self.read(args[0], index))
+            case "PUSHS":
+                value = self.read(args[0], index)
+                # the handler of the PUSHS checks the limit again and stops the program
+                if self.max_stack is not None:
+                    self.guard("len(stack) >= %d" % self.max_stack, index)
+                self.emit("push(%s)" % value)
+            case "POPS":
+                self.guard("not stack", index)
+                self.store(args[0], "stack.pop()")
+            case "ADDS" | "SUBS" | "MULS":
+                self.guard("len(stack) < 2 or type(stack[-1]) is not type(stack[-2]) "
+                           "or type(stack[-1]) is not int and type(stack[-1]) is not float", index)
+                name = self.temporary()
+                self.emit(name + " = stack.pop()")
+                self.emit("stack[-1] = stack[-1] %s %s" % (tier2_binary[opcode], name))
+            case "IDIVS" | "DIVS":
+                kind = "int" if opcode == "IDIVS" else "float"
+                self.guard("len(stack) < 2 or type(stack[-1]) is not %s or type(stack[-2]) is not %s"
+                           % (kind, kind), index)
+                self.guard("stack[-1] == 0", index)
+                name = self.temporary()
+                self.emit(name + " = stack.pop()")
+                self.emit("stack[-1] = stack[-1] %s %s" % (tier2_binary[opcode], name))
+            case "JUMPIFEQS" | "JUMPIFNEQS":
+                self.guard("len(stack) < 2", index)
+                first = self.temporary()
+                second = self.temporary()
+                self.emit("%s, %s = stack[-2:]" % (first, second))
+                equal = self.equality(first, second, index)
+                self.emit("del stack[-2:]")
+                self.jump(args[0].target, index, equal if opcode == "JUMPIFEQS" else "not " + equal)
+            case "JUMP":
+                self.jump(args[0].target, index)
+            case "JUMPIFEQ" | "JUMPIFNEQ":
+                equal = self.equality(self.read(args[1], index), self.read(args[2], index), index)
+                if equal is None:
+                    return False
+                self.jump(args[0].target, index, equal if opcode == "JUMPIFEQ" else "not " + equal)
+        return True
+
+    def compile(self):
+        instruction_list = self.instruction_list
+        index = self.start
+        end = len(instruction_list)
+        stop = min(end, self.start + tier2_limit)
+        while index < stop and instruction_list[index].opcode in tier2_opcodes:
+            if not self.instruction(instruction_list[index], index):
+                break
+            index += 1
+            if instruction_list[index - 1].opcode == "JUMP":
+                break
+        if index - self.start < 2:
+            return None
+        if instruction_list[index - 1].opcode != "JUMP":
+            self.leave(index)
+
+        # frames cannot change inside the region, they are fetched once and
+        # destinations have to be defined already
+        entry = []
+        if "LF" in self.frames_used:
+            entry += ["if not frames:", "    counter[0] += 1", "    return %d" % (self.start + 1),
+                      "lf = frames[-1]"]
+        if "TF" in self.frames_used:
+            entry += ["tf = temp_frame", "if tf is None:", "    counter[0] += 1", "    return %d" % (self.start + 1)]
+        # a region shorter than what is left of the budget runs in the handlers
+        entry += ["size = %d" % tier2_slice, "if remaining[0] is not None:",
+                  "    size = min(size, remaining[0] - %d)" % (index - self.start - 1),
+                  "    if size < 1:", "        counter[0] += 1", "        return %d" % (self.start + 1)]
+        if self.destinations:
+            entry += ["if " + " or ".join(location + " is None" for location in sorted(self.destinations)) + ":",
+                      "    counter[0] += 1", "    return %d" % (self.start + 1)]
+        source = "\n".join(
+            ["def factory(g, frames, stack, push, counter, remaining, write):", "    def block():"]
+            + ["        " + line for line in entry]
+            + ["        count = 0", "        while True:"]
+            + self.lines
+            + ["    return block"]) + "\n"
+        code = tier2_cache.get(source)
+        if code is None:
+            code = tier2_cache[source] = compile(source, "<tier2 %d>" % instruction_list[self.start].order, "exec")
+        namespace = {}
+        exec(code, globals(), namespace)
+        return namespace["factory"](self.global_frame, local_frame, data_stack, data_stack.append, tier2_executed,
+                                    tier2_remaining, standard_output.write)
+
+
+# name tables and global frame of the program decoded last, copied because the next
+# decode_program clears them
+def decoded_names():
+    return dict(global_names), dict(local_names), set(text_globals), set(text_locals), global_frame
+
+
+def make_tier2_counter(handlers, weights, instruction_list, index, threshold, names, max_stack):
+    original = handlers[index]
+    remaining = max(threshold, 1)
+
+    def op():
+        nonlocal remaining
+        remaining -= 1
+        if remaining == 0:
+            compiled = RegionCompiler(instruction_list, index, names, max_stack).compile()
+            if compiled is None:
+                handlers[index] = original
+            else:
+                # compiled function counts the instructions it runs itself
+                handlers[index] = compiled
+                weights[index] = 0
+        return original()
+    return op
+
+
+# with max_stack compiled PUSHS leaves the region before the stack would grow past it,
+# CALL and PUSHFRAME are never compiled
+def install_tier2(instruction_list, handlers, weights, threshold, max_stack=None):
+    names = decoded_names()
+    for index, instruction in enumerate(instruction_list):
+        if instruction.opcode == "LABEL":
+            handlers[index] = make_tier2_counter(handlers, weights, instruction_list, index, threshold, names,
+                                                 max_stack)
+
+
+# plain are the handlers before the peephole pass, with a limit they run instead of a
+# superinstruction that would go over it
+def interpret_threaded(handlers, weights=None, limit=None, plain=None):
+    global done_instructions, current_instruction_index
+    current = current_instruction_index
+    end = len(handlers)
+    executed = done_instructions
+    tier2_executed[0] = 0
+    tier2_remaining[0] = None
+    try:
+        while True:
+            try:
+                if limit is not None:
+                    if weights is None:
+                        weights = [1] * end
+                    while current < end:
+                        done = executed + tier2_executed[0]
+                        if done >= limit:
+                            raise BudgetExceeded("instructions", limit, done)
+                        tier2_remaining[0] = limit - done
+                        if done + weights[current] > limit and plain is not None:
+                            executed += 1
+                            current = plain[current]()
+                        else:
+                            executed += weights[current]
+                            current = handlers[current]()
+                elif weights is None:
+                    while current < end:
+                        executed += 1
+                        current = handlers[current]()
+                else:
+                    while current < end:
+                        executed += weights[current]
+                        current = handlers[current]()
+                break
+            except DebugBreak as request:
+                current = request.resume
+                error_output.write("Current instruction count: " + str(executed + tier2_executed[0]) + "\n")
+    finally:
+        done_instructions = executed + tier2_executed[0]
+        current_instruction_index = current
+
+
+# resource budgets, the instruction count is checked by the execution loops, everything
+# else by a timer signal so the loops do not pay for it
+budget_interval = 0.05
+
+
+# raised from the timer between any two bytecodes, it must not be caught as an
+# ordinary error by the instruction code
+class BudgetExceeded(BaseException):
+    def __init__(self, budget, limit, value):
+        self.budget = budget
+        self.limit = limit
+        self.value = value
+
+
+def peak_memory():
+    # megabytes, ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+
+
+class Budget:
+    def __init__(self, max_instructions=None, timeout=None, max_call_depth=None, max_stack=None,
+                 max_memory=None):
+        self.max_instructions = max_instructions
+        self.timeout = timeout
+        self.max_call_depth = max_call_depth
+        self.max_stack = max_stack
+        self.max_memory = max_memory
+        self.started = time.perf_counter()
+        self.deadline = None
+        self.previous = None
+
+    def watched(self):
+        return any(limit is not None for limit in (self.timeout, self.max_call_depth, self.max_stack,
+                                                   self.max_memory))
+
+    def check(self):
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise BudgetExceeded("timeout", self.timeout, round(time.perf_counter() - self.started, 3))
+        if self.max_call_depth is not None:
+            if len(call_stack) > self.max_call_depth:
+                raise BudgetExceeded("call depth", self.max_call_depth, len(call_stack))
+            if len(local_frame) > self.max_call_depth:
+                raise BudgetExceeded("frame depth", self.max_call_depth, len(local_frame))
+        if self.max_stack is not None and len(data_stack) > self.max_stack:
+            raise BudgetExceeded("data stack", self.max_stack, len(data_stack))
+        if self.max_memory is not None and peak_memory() > self.max_memory:
+            raise BudgetExceeded("memory", self.max_memory, peak_memory())
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.timeout is not None:
+            self.deadline = self.started + self.timeout
+        if self.watched():
+            self.previous = signal.signal(signal.SIGALRM, lambda number, frame: self.check())
+            signal.setitimer(signal.ITIMER_REAL, budget_interval, budget_interval)
+
+    def stop(self):
+        if self.previous is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self.previous)
+            self.previous = None
+
+    def report(self, exceeded, instruction_list):
+        unit = {"timeout": " s", "memory": " MB"}.get(exceeded.budget, "")
+        lines = ["Budget exceeded: %s %s%s (limit %s%s)" % (exceeded.budget, exceeded.value, unit,
+                                                              exceeded.limit, unit)]
+        position = ""
+        if current_instruction_index < len(instruction_list):
+            instruction = instruction_list[current_instruction_index]
+            position = ", at order %d (%s)" % (instruction.order, instruction.opcode)
+        lines.append("Executed %d instructions in %.3f s%s" % (done_instructions,
+                                                             time.perf_counter() - self.started, position))
+        lines.append("Call depth %d, data stack %d, peak memory %d MB" % (len(call_stack), len(data_stack),
+                                                                         peak_memory()))
+        return "".join(line + "\n" for line in lines)
+
+
+# CALL, PUSHFRAME and PUSHS check their depth right away, installed before the peephole
+# pass so labels that take over the next handler are checked as well
+def make_budget_check(handler, budget, opcode):
+    match opcode:
+        case "CALL":
+            calls = call_stack
+            limit = budget.max_call_depth
+
+            def op():
+                if len(calls) >= limit:
+                    raise BudgetExceeded("call depth", limit, len(calls) + 1)
+                return handler()
+        case "PUSHFRAME":
+            frames = local_frame
+            limit = budget.max_call_depth
+
+            def op():
+                if len(frames) >= limit:
+                    raise BudgetExceeded("frame depth", limit, len(frames) + 1)
+                return handler()
+        case _:
+            stack = data_stack
+            limit = budget.max_stack
+
+            def op():
+                if len(stack) >= limit:
+                    raise BudgetExceeded("data stack", limit, len(stack) + 1)
+                return handler()
+    return op
+
+
+def install_budget_checks(instruction_list, handlers, budget):
+    checked = set()
+    for index, instruction in enumerate(instruction_list):
+        opcode = instruction.opcode
+        if opcode in ("CALL", "PUSHFRAME") and budget.max_call_depth is not None \
+                or opcode == "PUSHS" and budget.max_stack is not None:
+            handlers[index] = make_budget_check(handlers[index], budget, opcode)
+            checked.add(index)
+    return checked
+
+
+# pure subroutines, --memoize keeps the results of CALL targets that depend only on the
+# data stack and the temporary frame, anything reaching I/O, EXIT, BREAK, CLEARS, GF
+# or the caller's local frame is not pure, values popped and pushed by stack opcodes
+# are (popped, pushed)
+memo_forbidden = ("WRITE", "READ", "DPRINT", "EXIT", "BREAK", "CLEARS")
+memo_stack_effects = {
+    "PUSHS": (0, 1), "POPS": (1, 0),
+    "ADDS": (2, 1), "SUBS": (2, 1), "MULS": (2, 1), "IDIVS": (2, 1), "DIVS": (2, 1),
+    "LTS": (2, 1), "GTS": (2, 1), "EQS": (2, 1), "ANDS": (2, 1), "ORS": (2, 1), "STRI2INTS": (2, 1),
+    "NOTS": (1, 1), "INT2CHARS": (1, 1), "INT2FLOATS": (1, 1), "FLOAT2INTS": (1, 1),
+    "JUMPIFEQS": (2, 0), "JUMPIFNEQS": (2, 0),
+}
+memo_size = 65536
+
+
+# walks everything reachable from start up to RETURN with (stack height, local frame
+# depth, TF state) relative to the call, TF is "entry" while it is still the caller's,
+# returns None when the code is not pure, otherwise the summary (popped, pushed, reads TF,
+# replaces TF) and whether every path was followed, calls without a summary yet stop
+# their path and the summary is None when no RETURN was reached
+def subroutine_summary(instruction_list, start, summaries, impure):
+    seen = {}
+    pending = [(start, (0, 0, "entry"))]
+    lowest = 0
+    returned = None
+    reads_tf = replaces_tf = blocked = False
+    while pending:
+        index, state = pending.pop()
+        if index in seen:
+            if seen[index] != state:
+                return None
+            continue
+        if index >= len(instruction_list):
+            return None
+        seen[index] = state
+        height, depth, tf = state
+        instruction = instruction_list[index]
+        opcode = instruction.opcode
+        if opcode in memo_forbidden:
+            return None
         for argument in instruction.arg_list:
-            if argument.val_type == "string":
-                escaped_list = re.findall(r'(\\[0-9]{3})+', str(argument.value))
+            if argument.val_type != "var":
+                continue
+            match argument.value[:2]:
+                case "GF":
+                    return None
+                case "LF":
+                    if depth == 0:
+                        return None
+                case _:
+                    if tf == "entry":
+                        reads_tf = replaces_tf = True
+        popped, pushed = memo_stack_effects.get(opcode, (0, 0))
+        height -= popped
+        lowest = min(lowest, height)
+        height += pushed
+        following = [index + 1]
+        match opcode:
+            case "CREATEFRAME":
+                tf = "own"
+            case "PUSHFRAME":
+                if tf == "entry":
+                    reads_tf = replaces_tf = True
+                depth += 1
+                tf = "none"
+            case "POPFRAME":
+                if depth == 0:
+                    return None
+                depth -= 1
+                tf = "own"
+            case "JUMP":
+                following = [instruction.arg_list[0].target]
+            case "JUMPIFEQ" | "JUMPIFNEQ" | "JUMPIFEQS" | "JUMPIFNEQS":
+                following.append(instruction.arg_list[0].target)
+            case "RETURN":
+                if depth != 0 or returned is not None and returned != (height, tf):
+                    return None
+                returned = (height, tf)
+                continue
+            case "CALL":
+                target = instruction.arg_list[0].target
+                if target in impure:
+                    return None
+                if target not in summaries:
+                    blocked = True
+                    continue
+                callee_popped, callee_pushed, callee_reads, callee_replaces = summaries[target]
+                if callee_reads and tf == "entry":
+                    reads_tf = replaces_tf = True
+                height -= callee_popped
+                lowest = min(lowest, height)
+                height += callee_pushed
+                if callee_replaces:
+                    tf = "own"
+        for successor in following:
+            pending.append((successor, (height, depth, tf)))
+    if returned is None:
+        return None, False
+    height, tf = returned
+    return (-lowest, height - lowest, reads_tf, replaces_tf or tf != "entry"), not blocked
+
+
+# recursive subroutines get their summary from the paths that return without the
+# recursive call first, every summary is then checked again with all of them known
+def pure_subroutines(instruction_list):
+    targets = sorted({instruction.arg_list[0].target for instruction in instruction_list
+                      if instruction.opcode == "CALL"})
+    summaries = {}
+    impure = set()
+    for _ in range(len(targets) + 1):
+        changed = False
+        for target in targets:
+            if target in impure:
+                continue
+            result = subroutine_summary(instruction_list, target, summaries, impure)
+            if result is None:
+                impure.add(target)
+                summaries.pop(target, None)
+                changed = True
+                continue
+            summary, _ = result
+            if summary is not None and summaries.get(target) != summary:
+                summaries[target] = summary
+                changed = True
+        if not changed:
+            break
+    verified = False
+    while not verified:
+        verified = True
+        for target in list(summaries):
+            if subroutine_summary(instruction_list, target, summaries, impure) != (summaries[target], True):
+                impure.add(target)
+                del summaries[target]
+                verified = False
+    return summaries
+
+
+# 1 and 1.0 and True are equal keys in a dict, so every value goes in with its type,
+# floats by their exact text so -0.0 stays apart from 0.0
+def memo_values(values):
+    key = []
+    for value in values:
+        kind = type(value)
+        if kind is Text:
+            value = value.text()
+            kind = str
+        elif kind is float:
+            value = value.hex()
+        key.append(kind)
+        key.append(value)
+    return tuple(key)
+
+
+def frame_key(frame):
+    if frame is None:
+        return None
+    defined = frame[-1]
+    return tuple(defined), memo_values([frame[slot] for slot in defined])
 
-                for escaped_uni in escaped_list:
-                    unicode_as_chr = chr(int(escaped_uni[1:]))
-                    argument.value = argument.value.replace(escaped_uni, unicode_as_chr)
-    check_labels(instruction_list)
-    interpret_code(instruction_list, input_file_split)
+
+# Text is edited in place, a kept frame holds plain strings instead
+def frame_snapshot(frame):
+    if frame is None:
+        return None
+    copy = frame.copy()
+    copy[-1] = frame[-1].copy()
+    for slot in copy[-1]:
+        if type(copy[slot]) is Text:
+            copy[slot] = copy[slot].text()
+    return copy
+
+
+class MemoTable:
+    def __init__(self, size=memo_size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        # (call depth, key, stack base, replaces TF) of calls that run right now
+        self.running = []
+        self.hits = 0
+        self.misses = 0
+        self.subroutines = 0
+
+    def store(self, key, result):
+        self.entries[key] = result
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+
+def make_memo_call(handler, table, target, summary, following):
+    popped, pushed, reads_tf, replaces_tf = summary
+    stack = data_stack
+    calls = call_stack
+    entries = table.entries
+    running = table.running
+
+    def op():
+        global temp_frame
+        base = len(stack) - popped
+        if base < 0:
+            # fails inside the subroutine the same way as without the table
+            return handler()
+        key = (target, memo_values(stack[base:]), frame_key(temp_frame) if reads_tf else None)
+        result = entries.get(key)
+        if result is not None:
+            entries.move_to_end(key)
+            table.hits += 1
+            del stack[base:]
+            stack.extend(result[0])
+            if replaces_tf:
+                frame = result[1]
+                if frame is not None:
+                    frame = frame.copy()
+                    frame[-1] = frame[-1].copy()
+                temp_frame = frame
+            return following
+        table.misses += 1
+        resume = handler()
+        running.append((len(calls), key, base, replaces_tf))
+        return resume
+    return op
+
+
+def make_memo_return(handler, table):
+    calls = call_stack
+    stack = data_stack
+    running = table.running
+
+    def op():
+        if running and running[-1][0] == len(calls):
+            _, key, base, replaces_tf = running.pop()
+            table.store(key, (tuple(stack[base:]), frame_snapshot(temp_frame) if replaces_tf else None))
+        return handler()
+    return op
+
+
+# installed before the peephole pass like the budget checks
+def install_memoization(instruction_list, handlers, table):
+    summaries = pure_subroutines(instruction_list)
+    table.subroutines = len(summaries)
+    if not summaries:
+        return
+    for index, instruction in enumerate(instruction_list):
+        match instruction.opcode:
+            case "CALL":
+                target = instruction.arg_list[0].target
+                if target in summaries:
+                    handlers[index] = make_memo_call(handlers[index], table, target, summaries[target], index + 1)
+            case "RETURN":
+                handlers[index] = make_memo_return(handlers[index], table)
+
+
+# STATI extension, collected by a separate loop so the plain loop above stays as is
+class Statistics:
+    not_counted = ("LABEL", "DPRINT", "BREAK")
+
+    def __init__(self, instruction_list):
+        self.opcodes = [instruction.opcode for instruction in instruction_list]
+        self.orders = [instruction.order for instruction in instruction_list]
+        self.hits = [0] * len(instruction_list)
+        self.times = [0] * len(instruction_list)
+        self.peak_vars = 0
+        self.memo = None
+
+    def opcode_counts(self):
+        counts = {}
+        for opcode, hits in zip(self.opcodes, self.hits):
+            counts[opcode] = counts.get(opcode, 0) + hits
+        return counts
+
+    def opcode_times(self):
+        times = {}
+        for opcode, elapsed in zip(self.opcodes, self.times):
+            times[opcode] = times.get(opcode, 0) + elapsed
+        return times
+
+    def insts(self):
+        return sum(hits for opcode, hits in zip(self.opcodes, self.hits) if opcode not in self.not_counted)
+
+    def hot(self):
+        best = None
+        for opcode, order, hits in zip(self.opcodes, self.orders, self.hits):
+            if opcode in self.not_counted or hits == 0:
+                continue
+            if best is None or hits > best[0] or (hits == best[0] and order < best[1]):
+                best = (hits, order)
+        return "" if best is None else best[1]
+
+    def frequent(self):
+        counts = {opcode: hits for opcode, hits in self.opcode_counts().items() if hits}
+        if not counts:
+            return ""
+        most = max(counts.values())
+        return ",".join(sorted(opcode for opcode, hits in counts.items() if hits == most))
+
+    def report(self, items):
+        parts = []
+        for item, value in items:
+            match item:
+                case "insts":
+                    parts.append(str(self.insts()) + "\n")
+                case "hot":
+                    parts.append(str(self.hot()) + "\n")
+                case "vars":
+                    parts.append(str(self.peak_vars) + "\n")
+                case "frequent":
+                    parts.append(self.frequent() + "\n")
+                case "memo_hits":
+                    parts.append(str(self.memo.hits if self.memo else 0) + "\n")
+                case "memo_misses":
+                    parts.append(str(self.memo.misses if self.memo else 0) + "\n")
+                case "print":
+                    parts.append(value + "\n")
+                case "eol":
+                    parts.append("\n")
+        return "".join(parts)
+
+    def as_json(self):
+        counts = self.opcode_counts()
+        times = self.opcode_times()
+        collected = {
+            "insts": self.insts(),
+            "hot": self.hot(),
+            "vars": self.peak_vars,
+            "executed": sum(self.hits),
+            "opcodes": {opcode: {"count": counts[opcode], "time_ns": times[opcode]} for opcode in sorted(counts)},
+            "instructions": [{"order": order, "opcode": opcode, "hits": hits, "time_ns": elapsed}
+                             for opcode, order, hits, elapsed
+                             in zip(self.opcodes, self.orders, self.hits, self.times) if hits],
+        }
+        if self.memo:
+            collected["memo"] = {"subroutines": self.memo.subroutines, "hits": self.memo.hits,
+                                 "misses": self.memo.misses, "entries": len(self.memo.entries)}
+        return json.dumps(collected, indent=2) + "\n"
+
+
+def initialized_in(frame):
+    if frame is None:
+        return 0
+    return sum(1 for slot in frame[-1] if frame[slot] is not uninitialized)
+
+
+def current_frame(kind):
+    match kind:
+        case "GF":
+            return global_frame
+        case "LF":
+            return local_frame[-1] if local_frame else None
+    return temp_frame
+
+
+# initialized variables change only through the destination operand of an
+# instruction or by dropping the temporary frame in CREATEFRAME/POPFRAME
+def interpret_threaded_stats(handlers, instruction_list, statistics, limit=None):
+    global done_instructions, current_instruction_index
+    destinations = []
+    for instruction in instruction_list:
+        signature = threaded_opcodes[instruction.opcode][0]
+        if signature and signature[0] == "var" and instruction.opcode != "DEFVAR":
+            destinations.append(resolve_variable(instruction.arg_list[0]))
+        else:
+            destinations.append(None)
+    drops_temporary = [instruction.opcode in ("CREATEFRAME", "POPFRAME") for instruction in instruction_list]
+    hits = statistics.hits
+    times = statistics.times
+    clock = time.perf_counter_ns
+    live = 0
+    current = current_instruction_index
+    end = len(handlers)
+    executed = done_instructions
+    try:
+        while current < end:
+            if limit is not None and executed >= limit:
+                raise BudgetExceeded("instructions", limit, executed)
+            index = current
+            executed += 1
+            hits[index] += 1
+            watched = destinations[index]
+            if watched is not None:
+                frame = current_frame(watched[0])
+                before = frame is not None and frame[watched[1]] is not None \
+                    and frame[watched[1]] is not uninitialized
+            elif drops_temporary[index]:
+                live -= initialized_in(temp_frame)
+            started = clock()
+            try:
+                current = handlers[index]()
+            except DebugBreak as request:
+                current = request.resume
+                error_output.write("Current instruction count: " + str(executed) + "\n")
+            times[index] += clock() - started
+            if watched is not None and not before:
+                frame = current_frame(watched[0])
+                if frame[watched[1]] is not uninitialized:
+                    live += 1
+                    if live > statistics.peak_vars:
+                        statistics.peak_vars = live
+    finally:
+        done_instructions = executed
+        current_instruction_index = current
+
+
+def write_statistics(file, items, output_format, statistics):
+    try:
+        with open(file, "w") as stats_file:
+            if output_format == "json":
+                stats_file.write(statistics.as_json())
+            else:
+                stats_file.write(statistics.report(items))
+    except OSError:
+        Error.error_exit(twelve)
+
+
+# execution trace, a ring of 32-bit records (event kind in the top 3 bits, instruction
+# index below) that is written out with a listing of the program when the run ends
+trace_sample = 0
+trace_call = 1
+trace_return = 2
+trace_resume = 3
+trace_pushframe = 4
+trace_popframe = 5
+trace_break = 6
+trace_stop = 7
+trace_events = {"CALL": trace_call, "RETURN": trace_return, "PUSHFRAME": trace_pushframe,
+                "POPFRAME": trace_popframe, "BREAK": trace_break}
+trace_kinds = ("exec", "call", "return", "resume", "pushframe", "popframe", "break", "stop")
+trace_magic = b"IPPT\x01"
+trace_typecode = "I" if array.array("I").itemsize == 4 else "L"
+
+
+def trace_operand(argument):
+    value = (argument.value or "").replace("\n", "\\010").replace(" ", "\\032")
+    if argument.val_type in ("var", "label", "type"):
+        return value
+    return argument.val_type + "@" + value
+
+
+class TraceRecorder:
+    def __init__(self, instruction_list, size=65536, every=1):
+        capacity = 1
+        while capacity < size:
+            capacity *= 2
+        self.ring = array.array(trace_typecode, bytes(4 * capacity))
+        self.every = max(every, 1)
+        self.written = 0
+        self.code = 0
+        self.listing = [" ".join([str(instruction.order), instruction.opcode]
+                                 + [trace_operand(argument) for argument in instruction.arg_list])
+                        for instruction in instruction_list]
+        self.marks = [trace_events.get(instruction.opcode, 0) << 29 for instruction in instruction_list]
+
+    # oldest record first
+    def records(self):
+        capacity = len(self.ring)
+        if self.written <= capacity:
+            return self.ring[:self.written]
+        position = self.written & (capacity - 1)
+        return self.ring[position:] + self.ring[:position]
+
+    def dump(self, file):
+        records = self.records()
+        if sys.byteorder == "big":
+            records.byteswap()
+        listing = "\n".join(self.listing).encode()
+        try:
+            with open(file, "wb") as trace_file:
+                trace_file.write(trace_magic)
+                trace_file.write(struct.pack("<IIQQiII", self.every, len(self.ring), self.written,
+                                             done_instructions, self.code, len(listing), len(records)))
+                trace_file.write(listing)
+                trace_file.write(records.tobytes())
+        except OSError:
+            Error.error_exit(twelve)
+
+
+def read_trace(file):
+    with open(file, "rb") as trace_file:
+        data = trace_file.read()
+    if data[:len(trace_magic)] != trace_magic:
+        raise ValueError(file + " is not an execution trace")
+    start = len(trace_magic)
+    header = struct.Struct("<IIQQiII")
+    every, capacity, written, executed, code, listing_size, count = header.unpack_from(data, start)
+    start += header.size
+    listing = data[start:start + listing_size].decode().split("\n")
+    start += listing_size
+    records = array.array(trace_typecode, data[start:start + 4 * count])
+    if sys.byteorder == "big":
+        records.byteswap()
+    return {"every": every, "capacity": capacity, "written": written, "executed": executed, "code": code,
+            "listing": listing, "records": [(record >> 29, record & 0x1FFFFFFF) for record in records]}
+
+
+# calls, returns and frame changes are recorded by wrappers around their handlers, the
+# loop itself only samples every Nth instruction, position is shared in cursor
+def trace_handler(handler, recorder, cursor, kind, index):
+    ring = recorder.ring
+    mask = len(ring) - 1
+    record = kind << 29 | index
+
+    if kind == trace_return:
+        def op():
+            ring[cursor[0] & mask] = record
+            following = handler()
+            ring[(cursor[0] + 1) & mask] = trace_resume << 29 | following
+            cursor[0] += 2
+            return following
+    else:
+        def op():
+            ring[cursor[0] & mask] = record
+            cursor[0] += 1
+            return handler()
+    return op
+
+
+# a run that ends with an error or EXIT leaves a stop record with the instruction it ended on
+def interpret_threaded_trace(handlers, recorder, limit=None):
+    global done_instructions, current_instruction_index
+    ring = recorder.ring
+    mask = len(ring) - 1
+    every = recorder.every
+    cursor = [recorder.written]
+    handlers = [trace_handler(handler, recorder, cursor, mark >> 29, index) if mark else handler
+                for index, (handler, mark) in enumerate(zip(handlers, recorder.marks))]
+    current = current_instruction_index
+    end = len(handlers)
+    executed = done_instructions
+    next_sample = executed + every
+    stop = float("inf") if limit is None else limit + 1
+    sample = min(next_sample, stop)
+    try:
+        while True:
+            try:
+                while current < end:
+                    executed += 1
+                    if executed >= sample:
+                        if executed >= stop:
+                            executed -= 1
+                            raise BudgetExceeded("instructions", limit, executed)
+                        if executed >= next_sample:
+                            next_sample += every
+                            ring[cursor[0] & mask] = current
+                            cursor[0] += 1
+                        sample = min(next_sample, stop)
+                    current = handlers[current]()
+                break
+            except DebugBreak as request:
+                current = request.resume
+                error_output.write("Current instruction count: " + str(executed) + "\n")
+    except (SystemExit, BudgetExceeded) as request:
+        # handler that ended the run has not returned, current is still its index
+        if isinstance(request, BudgetExceeded):
+            recorder.code = sixty.code
+        else:
+            recorder.code = request.code if isinstance(request.code, int) else 1
+        ring[cursor[0] & mask] = trace_stop << 29 | current
+        cursor[0] += 1
+        raise
+    finally:
+        recorder.written = cursor[0]
+        done_instructions = executed
+        current_instruction_index = current
+
+
+# embedding API, program is loaded and decoded once and then run any number of times
+# inside the calling process, every run starts from empty frames and stacks
+class ProgramError(Exception):
+    def __init__(self, code):
+        super().__init__("program cannot be loaded, exit code " + str(code))
+        self.code = code
+
+
+class Program:
+    # source is a path, XML as bytes or str, or a binary stream, compact keeps the
+    # program as a CompactProgram
+    def __init__(self, source, optimize=0, cache_dir=None, compact=False):
+        # the host may run with the collector off and keeps it that way
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            if isinstance(source, (bytes, str)) and source.lstrip()[:1] in (b"<", "<"):
+                if isinstance(source, str):
+                    source = source.encode()
+                instruction_list = load_stream(io.BytesIO(source), compact)
+            elif hasattr(source, "read"):
+                instruction_list = load_stream(source, compact)
+            else:
+                instruction_list = load_program(os.fspath(source), cache_dir, compact)
+            handlers = decode_program(instruction_list)
+            self.removed = self.folded = 0
+            if optimize >= 2:
+                instruction_list, self.removed, self.folded = fold_program(instruction_list)
+                if compact:
+                    instruction_list = compact_program(instruction_list)
+                handlers = decode_program(instruction_list)
+        except SystemExit as request:
+            raise ProgramError(request.code) from None
+        finally:
+            if collecting:
+                gc.enable()
+        self.weights = None
+        if optimize:
+            handlers, self.weights = optimize_program(instruction_list, handlers)
+        if optimize >= 3:
+            install_tier2(instruction_list, handlers, self.weights, tier2_threshold)
+        self.instruction_list = instruction_list
+        self.handlers = handlers
+        # handlers hold these lists, runs reset them in place
+        self.global_frame = global_frame
+        self.local_template = local_template
+
+    # input is a path, a text stream or None for empty input, output is returned
+    # as a string unless stdout is given
+    def run(self, input=None, stdout=None, stderr=None):
+        global global_frame, local_template, temp_frame, input_reader
+        global current_instruction_index, done_instructions
+        global_frame = self.global_frame
+        local_template = self.local_template
+        global_frame[:] = [None] * len(global_frame)
+        local_frame.clear()
+        data_stack.clear()
+        call_stack.clear()
+        # pooled frames may come from another program with a different template
+        frame_pool.clear()
+        temp_frame = None
+        current_instruction_index = 0
+        done_instructions = 0
+
+        captured = None
+        if stdout is None:
+            stdout = captured = io.StringIO()
+        saved = (standard_output.stream, error_output.stream, sys.stderr)
+        standard_output.stream = stdout
+        if stderr is not None:
+            error_output.stream = sys.stderr = stderr
+        opened = None
+        code = 0
+        try:
+            if input is None:
+                input_reader = InputReader(io.StringIO())
+            elif hasattr(input, "readline"):
+                input_reader = InputReader(input)
+            else:
+                input_reader = opened = open_input(os.fspath(input))
+            interpret_threaded(self.handlers, self.weights)
+        except SystemExit as request:
+            code = request.code or 0
+        finally:
+            flush_outputs()
+            standard_output.stream, error_output.stream, sys.stderr = saved
+            if opened:
+                opened.stream.close()
+        return code, None if captured is None else captured.getvalue()
+
+    # inputs are split between forked workers that share the decoded program,
+    # results come back in the order of inputs
+    def run_many(self, inputs, jobs=None):
+        inputs = list(inputs)
+        jobs = min(jobs or len(os.sched_getaffinity(0)), len(inputs))
+        if jobs <= 1:
+            return [self.run(item) for item in inputs]
+        sys.stdout.flush()
+        sys.stderr.flush()
+        gc.freeze()
+        workers = []
+        for worker in range(jobs):
+            read_end, write_end = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                status = 99
+                try:
+                    os.close(read_end)
+                    results = [self.run(item) for item in inputs[worker::jobs]]
+                    with os.fdopen(write_end, "wb") as pipe:
+                        pipe.write(marshal.dumps(results))
+                    status = 0
+                finally:
+                    os._exit(status)
+            os.close(write_end)
+            workers.append((pid, read_end))
+
+        results = [None] * len(inputs)
+        for worker, (pid, read_end) in enumerate(workers):
+            with os.fdopen(read_end, "rb") as pipe:
+                data = pipe.read()
+            os.waitpid(pid, 0)
+            if not data:
+                raise ChildProcessError("worker " + str(pid) + " did not return results")
+            results[worker::jobs] = marshal.loads(data)
+        return results
+
+
+def main():
+    global input_reader
+    arguments = argument_parser()
+    line_buffered = arguments.line_buffered or sys.stdout.isatty()
+    for output in (standard_output, error_output):
+        output.size = max(arguments.output_buffer, 0)
+        output.line_buffered = line_buffered
+
+    # loading allocates only objects that live until the end, collector would just
+    # walk the growing program over and over
+    gc.disable()
+    instruction_list = load_program(arguments.source, arguments.cache_dir, arguments.compact)
+    budget = Budget(arguments.max_instructions, arguments.timeout, arguments.max_call_depth, arguments.max_stack,
+                    arguments.max_memory)
+    weights = plain = None
+    if arguments.engine != "classic":
+        handlers = decode_program(instruction_list)
+        # statistics and traces see every instruction by itself, they run the plain handlers
+        optimize = 0 if arguments.stats or arguments.trace else arguments.optimize
+        if optimize >= 2:
+            instruction_list, removed, folded = fold_program(instruction_list)
+            if arguments.compact:
+                instruction_list = compact_program(instruction_list)
+            handlers = decode_program(instruction_list)
+            if arguments.optimize_report:
+                error_output.write("Optimizer: %d instructions removed, %d folded\n" % (removed, folded))
+        checked = install_budget_checks(instruction_list, handlers, budget)
+        if arguments.memoize:
+            memo = MemoTable(arguments.memo_size)
+            install_memoization(instruction_list, handlers, memo)
+            if arguments.optimize_report:
+                error_output.write("Memoization: %d pure subroutines\n" % memo.subroutines)
+        if optimize:
+            plain = handlers
+            handlers, weights = optimize_program(instruction_list, handlers, checked)
+        if optimize >= 3:
+            install_tier2(instruction_list, handlers, weights, arguments.tier2_threshold, budget.max_stack)
+    if arguments.program_report:
+        size = program_bytes(instruction_list)
+        error_output.write("Program: %d instructions, %d bytes, %.1f bytes per instruction\n"
+                           % (len(instruction_list), size, size / max(len(instruction_list), 1)))
+    gc.freeze()
+    gc.enable()
+
+    input_reader = open_input(arguments.input)
+
+    statistics = Statistics(instruction_list) if arguments.stats else None
+    if statistics and arguments.memoize:
+        statistics.memo = memo
+    recorder = None
+    if arguments.trace:
+        recorder = TraceRecorder(instruction_list, arguments.trace_size, arguments.trace_every)
+    limit = arguments.max_instructions
+    try:
+        budget.start()
+        try:
+            if arguments.engine == "classic":
+                interpret_code(instruction_list, input_reader, limit)
+            elif statistics:
+                interpret_threaded_stats(handlers, instruction_list, statistics, limit)
+            elif recorder:
+                interpret_threaded_trace(handlers, recorder, limit)
+            else:
+                interpret_threaded(handlers, weights, limit, plain)
+        except MemoryError:
+            if budget.max_memory is None:
+                raise
+            raise BudgetExceeded("memory", budget.max_memory, peak_memory()) from None
+        finally:
+            budget.stop()
+    except BudgetExceeded as exceeded:
+        error_output.write(budget.report(exceeded, instruction_list))
+        Error.error_exit(sixty)
+    finally:
+        flush_outputs()
+        if recorder:
+            recorder.dump(arguments.trace)
+        if statistics:
+            write_statistics(arguments.stats, getattr(arguments, "stats_items", None) or [],
+                             arguments.stats_format, statistics)
 
 
 if __name__ == '__main__':
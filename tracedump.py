@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# turns a trace written by interpret.py --trace back into a readable listing, calls
+# indent what runs inside them, --counts shows which instructions the samples hit
+import argparse
+import sys
+
+import interpret
+
+
+def listing(trace, last):
+    records = trace["records"]
+    if last:
+        records = records[-last:]
+    program = trace["listing"]
+    lines = []
+    depth = 0
+    for kind, index in records:
+        name = interpret.trace_kinds[kind]
+        if kind == interpret.trace_resume:
+            # a resume points behind the CALL it returns from
+            text = "-> " + (program[index] if index < len(program) else "end of program")
+        else:
+            text = program[index]
+        lines.append("%-9s %s%s" % (name, "  " * depth, text))
+        if kind == interpret.trace_call:
+            depth += 1
+        elif kind == interpret.trace_return:
+            depth = max(depth - 1, 0)
+    return lines
+
+
+def counts(trace):
+    hits = {}
+    for kind, index in trace["records"]:
+        if kind != interpret.trace_resume:
+            hits[index] = hits.get(index, 0) + 1
+    return ["%8d  %s" % (count, trace["listing"][index])
+            for index, count in sorted(hits.items(), key=lambda item: (-item[1], item[0]))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print an execution trace written by interpret.py --trace')
+    parser.add_argument('trace', help='Trace file')
+    parser.add_argument('--last', type=int, metavar='N', help='Only the last N records')
+    parser.add_argument('--counts', action='store_true', help='Records per instruction instead of the listing')
+    arguments = parser.parse_args()
+
+    try:
+        trace = interpret.read_trace(arguments.trace)
+    except (OSError, ValueError) as problem:
+        parser.error(str(problem))
+    kept = len(trace["records"])
+    print("%d records written, last %d kept, every %d. instruction sampled, %d executed, exit code %d"
+          % (trace["written"], kept, trace["every"], trace["executed"], trace["code"]))
+    lines = counts(trace) if arguments.counts else listing(trace, arguments.last)
+    sys.stdout.write("".join(line + "\n" for line in lines))
+
+
+if __name__ == '__main__':
+    main()